@@ -0,0 +1,112 @@
+"""Micro-batching of concurrent prediction requests.
+
+`PredictionCoalescer` parks incoming queries for up to `window_ms` (or until
+`max_batch_size` are waiting), then runs them through `predict_character_batch`
+as a single job on the `InferenceExecutor`: one batched encode and one batched
+index search instead of one of each per request. Every request still takes its
+own admission slot, so the executor's queue bound applies per query.
+"""
+import asyncio
+import os
+from collections import Counter
+
+BATCH_WINDOW_MS = float(os.environ.get('PREDICT_BATCH_WINDOW_MS', 5))
+MAX_BATCH_SIZE = int(os.environ.get('PREDICT_MAX_BATCH_SIZE', 16))
+
+
+class PredictionCoalescer:
+    def __init__(self, executor, batch_fn, window_ms=BATCH_WINDOW_MS, max_batch_size=MAX_BATCH_SIZE):
+        self.executor = executor
+        self.batch_fn = batch_fn
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+
+        # (k, score_method, min_confidence) -> [(query, future), ...]
+        self._pending = {}
+        self._timers = {}
+
+        self.batches = 0
+        self.items = 0
+        self.full_flushes = 0
+        self.batch_sizes = Counter()
+
+    async def predict(self, query, k=20, score_method="reciprocal_rank_fusion", min_confidence=0.25,
+                      deadline=None, request=None):
+        """Queue a query for the next batch and wait for its result."""
+        key = (k, score_method, min_confidence)
+        # Unhashable arguments must fail before a slot is taken, or it would never be released
+        hash(key)
+        self.executor.admit()
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+
+        bucket = self._pending.setdefault(key, [])
+        bucket.append((query, fut))
+
+        if len(bucket) >= self.max_batch_size:
+            self.full_flushes += 1
+            self._flush(key)
+        elif len(bucket) == 1:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+
+        return await self.executor.wait(fut, deadline=deadline, request=request)
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        bucket = self._pending.pop(key, [])
+
+        # Requests that timed out or disconnected while parked give their slot back now
+        live = [(q, f) for q, f in bucket if not f.cancelled()]
+        if len(live) < len(bucket):
+            self.executor.release(len(bucket) - len(live))
+        if not live:
+            return
+
+        self.batches += 1
+        self.items += len(live)
+        self.batch_sizes[len(live)] += 1
+
+        k, score_method, min_confidence = key
+        queries = [q for q, _ in live]
+        futures = [f for _, f in live]
+        try:
+            job = self.executor.dispatch(self.batch_fn, queries, k, score_method, min_confidence, slots=len(live))
+        except Exception as e:
+            _fail_all(futures, e)
+            return
+        job.add_done_callback(lambda j: _fan_out(j, futures))
+
+    def stats(self):
+        return {
+            "window_ms": self.window * 1000.0,
+            "max_batch_size": self.max_batch_size,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / self.batches, 3) if self.batches else 0.0,
+            "max_observed_batch_size": max(self.batch_sizes) if self.batch_sizes else 0,
+            "full_flushes": self.full_flushes,
+            "batch_size_histogram": {str(size): n for size, n in sorted(self.batch_sizes.items())},
+            "parked": sum(len(b) for b in self._pending.values()),
+        }
+
+
+def _fail_all(futures, exc):
+    for f in futures:
+        if not f.done():
+            f.set_exception(exc)
+
+
+def _fan_out(job, futures):
+    if job.cancelled():
+        for f in futures:
+            f.cancel()
+        return
+    exc = job.exception()
+    if exc is not None:
+        _fail_all(futures, exc)
+        return
+    for f, result in zip(futures, job.result()):
+        if not f.done():
+            f.set_result(result)
@@ -1,11 +1,24 @@
 from pathlib import Path
-import pickle
+import argparse
 
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+import faiss
+import numpy as np
 
-DOCS_PATH = Path("data/processed/documents.pkl")
+import columnar
+import corpus_encoder
+import line_pooling
+from chunking import DATA_PATH, iter_chunked_documents, iter_contextual_documents, iter_documents
+from doc_store import ArrayDocStore
+from embedding_store import EmbeddingStore
+from sparse_index import SparseIndex
+from prototypes import build_prototypes, save_prototypes
+import index_factory
+
+DOCS_PATH = Path("data/processed/documents.arrow")
 INDEX_DIR = Path("data/index/faiss")
+# Document vectors from earlier builds, one SQLite file per model, keyed by chunk content;
+# --pool builds keep their line vectors in a separate `<model_key>.lines.sqlite`
+CACHE_DIR = Path("data/index/embedding_cache")
 
 # Better embedding models to try (in order of quality vs speed):
 EMBEDDING_MODELS = {
@@ -16,61 +29,204 @@ EMBEDDING_MODELS = {
 }
 
 
-def main(model_key="mpnet"):
+def main(model_key="mpnet", index_type="flat", quantization="none", reduce="none", index_dir=INDEX_DIR,
+         prototypes_per_character=1, cache=True, prune=False, workers=0, batch_size=256, pool="none",
+         chunk_size=15, overlap=5, window_size=5, **index_params):
     """
     Build FAISS index with better embedding model.
     
     Args:
         model_key: Which embedding model to use (mini, mpnet, e5, instructor)
+        index_type: flat (exact), ivf_flat, ivf_pq or hnsw
+        quantization: How the index stores vectors: none (float32), fp16,
+            int8 (scalar quantization) or pq (product quantization)
+        reduce: Build the index in a reduced space: none, pca (learned
+            projection) or truncate (Matryoshka-style prefix); the full
+            vectors are kept for re-ranking
+        index_dir: Output directory, e.g. data/index/faiss_mini for the
+            first stage of a model cascade (see CASCADE_INDEX_DIR)
+        prototypes_per_character: k-means prototypes stored per character
+            for the `prototype` score method (1 = the mean vector)
+        cache: Reuse document vectors from earlier builds with the same model
+            (`CACHE_DIR/<model_key>.sqlite`, or `<model_key>.lines.sqlite` for
+            pooled builds) and only encode changed chunks or lines
+        prune: Drop cached vectors of chunks (or, for pooled builds, lines)
+            that are no longer in the corpus
+        workers: Encoder processes (0 encodes in this process); encoding is
+            checkpointed, so an interrupted build resumes where it stopped
+        batch_size: Documents per encoding batch
+        pool: none (encode the documents from chunking.py), or chunked /
+            contextual to encode each dialogue line once and pool line
+            vectors into documents here (see line_pooling)
+        chunk_size, overlap: Lines per chunk and lines shared between
+            chunks for pool=chunked
+        window_size: Lines either side of each line for pool=contextual
+        index_params: nlist, nprobe, pq_m, pq_nbits, hnsw_m, ef_construction,
+            ef_search, rerank_factor, reduce_dim (see index_factory.DEFAULT_PARAMS)
     """
     
-    with open(DOCS_PATH, "rb") as f:
-        documents = pickle.load(f)
-    
-    print(f"📚 Loaded {len(documents)} documents")
+    index_dir = Path(index_dir)
+    params = {**index_factory.DEFAULT_PARAMS, **{k: v for k, v in index_params.items() if v is not None}}
+    index_dir.mkdir(parents=True, exist_ok=True)
     
     model_name = EMBEDDING_MODELS[model_key]
-    print(f"🤖 Using embedding model: {model_name}")
+    print(f"🤖 Using embedding model: {model_name} ({workers or 'no'} worker processes)")
+    # Each granularity has its own store, so --prune only drops vectors of the one being built
+    cache_name = f"{model_key}.sqlite" if pool == "none" else f"{model_key}.lines.sqlite"
+    store = EmbeddingStore(CACHE_DIR / cache_name, model_name, dtype=np.float32) if cache else None
+    
+    # Indexes that need no training take each batch as soon as it is encoded
+    streamed = {}
+    
+    if pool == "none":
+        # Stream the documents straight into the columnar docstore; texts are
+        # then read back from it batch by batch instead of held as a list
+        num_docs = ArrayDocStore.write(index_dir, iter_documents(DOCS_PATH))
+        docstore = ArrayDocStore.load(index_dir)
+        texts = docstore.texts
+        print(f"📚 Loaded {num_docs} documents")
+        
+        def add_batch(start, batch_vectors):
+            if "index" not in streamed:
+                streamed["index"] = index_factory.make_index(
+                    batch_vectors.shape[1], index_type, n_vectors=num_docs, quantization=quantization,
+                    **index_params
+                )
+            if streamed["index"].is_trained:
+                streamed["index"].add(batch_vectors)
+        
+        # Encode in document order so vector i and docstore row i describe the same chunk
+        vectors = corpus_encoder.encode_corpus(
+            texts, model_name, index_dir / index_factory.VECTORS_FILE, store=store, workers=workers,
+            batch_size=batch_size, on_batch=add_batch if reduce == "none" else None,
+        )
+    else:
+        # Encode every line once, then pool line vectors into the documents
+        df = columnar.read_dialogues(DATA_PATH, columns=["character", "text"])
+        line_texts, offsets = line_pooling.character_lines(df)
+        print(f"📜 Encoding {len(line_texts)} dialogue lines, pooled into {pool} documents")
+        line_vectors = line_pooling.encode_lines(line_texts, model_name, model_key, store=store, workers=workers,
+                                                 batch_size=batch_size)
+        if pool == "chunked":
+            documents = iter_chunked_documents(df, chunk_size=chunk_size, overlap=overlap)
+        else:
+            documents = iter_contextual_documents(df, window_size=window_size)
+        num_docs = ArrayDocStore.write(index_dir, documents)
+        docstore = ArrayDocStore.load(index_dir)
+        texts = line_texts
+        
+        pooled = line_pooling.pooled_vectors(line_vectors, offsets, pool, chunk_size, overlap, window_size)
+        if len(pooled) != num_docs:
+            raise ValueError(f"Pooled {len(pooled)} vectors for {num_docs} documents")
+        vectors_path = index_dir / index_factory.VECTORS_FILE
+        np.save(vectors_path, pooled)
+        # The encoder's checkpoint would otherwise vouch for these vectors on a later unpooled build
+        vectors_path.with_name(vectors_path.name + corpus_encoder.CHECKPOINT_SUFFIX).unlink(missing_ok=True)
+        vectors = np.load(vectors_path, mmap_mode="r")
+        print(f"📚 Pooled {num_docs} documents from line vectors")
+    
+    if store is not None:
+        if prune:
+            print(f"🧹 Pruned {store.prune(texts)} vectors of removed {'chunks' if pool == 'none' else 'lines'}")
+        store.close()
+    
+    projection = None
+    if reduce != "none":
+        print(f"📉 Reducing {vectors.shape[1]} → {params['reduce_dim']} dims ({reduce})")
+        projection = index_factory.fit_projection(vectors, reduce, params["reduce_dim"])
+        index_factory.save_projection(index_dir, projection)
+    else:
+        (index_dir / index_factory.PROJECTION_FILE).unlink(missing_ok=True)
+    
+    index = streamed.get("index")
+    if index is None or not index.is_trained:
+        # IVF, PQ, int8 and reduced indexes are trained once every vector exists
+        print(f"🔨 Building {index_type} FAISS index ({quantization} storage)...")
+        index = index_factory.build_index(vectors, index_type, quantization, projection, **index_params)
+    
+    # Save the index next to the docstore and full-precision vectors
+    faiss.write_index(index, str(index_dir / "index.faiss"))
     
-    # Initialize embeddings
-    # Note: all-mpnet-base-v2 is generally better than all-MiniLM-L6-v2
-    # for semantic similarity tasks
-    embeddings = HuggingFaceEmbeddings(
-        model_name=model_name,
-        model_kwargs={'device': 'cpu'},  # Use 'cuda' if you have GPU
-        encode_kwargs={'normalize_embeddings': True}  # Important for cosine similarity
-    )
+    # BM25 index over the same rows, for hybrid / sparse-prefilter retrieval
+    print("🔤 Building BM25 sparse index...")
+    sparse = SparseIndex.build(docstore.texts)
+    sparse.save(index_dir)
+    print(f"   {len(sparse.vocabulary)} terms, {sparse.term_docs.nnz} postings")
     
-    print("🔨 Building FAISS index...")
+    # Character prototypes, for the nearest-centroid score method / pre-stage
+    prototypes = build_prototypes(vectors, docstore.character_names(), prototypes_per_character)
+    save_prototypes(index_dir, prototypes)
+    print(f"🎯 {len(prototypes['vectors'])} prototypes for {len(set(prototypes['characters']))} characters")
     
-    # Create vector store
-    vectorstore = FAISS.from_documents(
-        documents=documents,
-        embedding=embeddings
-    )
+    if index_type.startswith("ivf") and params["nlist"] is None:
+        params["nlist"] = index_factory.default_nlist(len(vectors))
+    index_factory.write_config(index_dir, {
+        "model_key": model_key,
+        "model_name": model_name,
+        "dim": int(vectors.shape[1]),
+        "num_vectors": int(index.ntotal),
+        "index_type": index_type,
+        "quantization": quantization,
+        "reduce": reduce,
+        "pool": pool,
+        **params,
+    })
     
-    # Save index
-    INDEX_DIR.mkdir(parents=True, exist_ok=True)
-    vectorstore.save_local(str(INDEX_DIR))
+    index_mb = (index_dir / "index.faiss").stat().st_size / 2 ** 20
+    print(f"💾 Index size: {index_mb:.1f} MB ({vectors.nbytes / 2 ** 20:.1f} MB as float32)")
     
     print(f"✅ FAISS index built and saved")
-    print(f"📍 Index location: {INDEX_DIR}")
+    print(f"📍 Index location: {index_dir}")
     
     # Quick test
     print("\n🧪 Testing index with sample query...")
     test_query = "You're in my spot"
-    results = vectorstore.similarity_search_with_score(test_query, k=5)
+    embeddings = corpus_encoder.document_encoder(model_name)
+    query_vector = np.asarray([embeddings.embed_query(test_query)], dtype=np.float32)
+    if projection is not None:
+        query_vector = index_factory.project(query_vector, projection)
+    index_factory.apply_search_params(index, index_factory.search_params(index_factory.load_config(index_dir)))
+    distances, rows = index.search(query_vector, 5)
     
     print(f"\nQuery: '{test_query}'")
     print("\nTop 5 results:")
-    for i, (doc, score) in enumerate(results, 1):
-        char = doc.metadata.get('character', 'Unknown')
-        text_preview = doc.page_content[:100]
+    for i, (row, score) in enumerate(zip(rows[0], distances[0]), 1):
+        char = docstore.character(row)
+        text_preview = docstore.text(row, max_chars=100)
         print(f"{i}. [{char}] (score: {score:.4f})")
         print(f"   {text_preview}...")
         print()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the FAISS index used by predict_character.")
     # Use mpnet for better quality, or mini for faster performance
-    main(model_key="mpnet")
\ No newline at end of file
+    parser.add_argument("--model", dest="model_key", default="mpnet", choices=sorted(EMBEDDING_MODELS))
+    parser.add_argument("--index-dir", default=INDEX_DIR, help="Output directory (default data/index/faiss)")
+    parser.add_argument("--index-type", default="flat", choices=index_factory.INDEX_TYPES)
+    parser.add_argument("--quantization", default="none", choices=index_factory.QUANTIZATIONS)
+    parser.add_argument("--reduce", default="none", choices=index_factory.REDUCTIONS)
+    parser.add_argument("--reduce-dim", type=int, help="Target dimension for --reduce (default 256)")
+    parser.add_argument("--nlist", type=int, help="IVF cells (default ~4*sqrt(n))")
+    parser.add_argument("--nprobe", type=int, help="IVF cells searched per query")
+    parser.add_argument("--pq-m", type=int, help="PQ sub-quantizers for ivf_pq")
+    parser.add_argument("--pq-nbits", type=int, help="Bits per PQ code for ivf_pq")
+    parser.add_argument("--hnsw-m", type=int, help="HNSW graph degree")
+    parser.add_argument("--ef-construction", type=int, help="HNSW build-time beam width")
+    parser.add_argument("--ef-search", type=int, help="HNSW query-time beam width")
+    parser.add_argument("--no-cache", dest="cache", action="store_false",
+                        help="Re-encode every chunk instead of reusing cached vectors")
+    parser.add_argument("--prune", action="store_true", help="Remove cached vectors of deleted chunks")
+    parser.add_argument("--workers", type=int, default=0, help="Encoder processes (default: encode in-process)")
+    parser.add_argument("--batch-size", type=int, default=256, help="Documents per encoding batch")
+    parser.add_argument("--pool", default="none", choices=("none",) + line_pooling.STRATEGIES,
+                        help="Encode each dialogue line once and pool line vectors into chunked/contextual documents")
+    parser.add_argument("--chunk-size", type=int, default=15, help="Lines per chunk for --pool chunked")
+    parser.add_argument("--overlap", type=int, default=5, help="Lines shared by consecutive chunks (--pool chunked)")
+    parser.add_argument("--window-size", type=int, default=5, help="Lines either side for --pool contextual")
+    parser.add_argument("--prototypes-per-character", type=int, default=1,
+                        help="k-means prototypes per character for the prototype score method (1 = centroid)")
+    parser.add_argument("--rerank-factor", type=int,
+                        help="Re-rank k*factor candidates with full-precision vectors (default 4 if lossy, else off)")
+    args = parser.parse_args()
+    main(**vars(args))
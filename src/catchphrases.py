@@ -1,6 +1,97 @@
+"""Signature lines that identify a speaker on their own.
+
+Each confidence is the phrase's speaker precision in the dialogue data: of
+the lines containing it, the share spoken by `character` (`hits` of them
+contain it). Only phrases with enough support and a clear speaker are kept;
+rerun the check after changing the table or the data:
+    python src/catchphrases.py
+"""
+import argparse
+import re
+
+# Keys are matched case-insensitively as whole words, ignoring punctuation between words.
 CATCHPHRASES = {
     "bazinga": {
         "character": "Sheldon",
-        "confidence": 0.95
-    }
+        "confidence": 0.88,  # 15/17
+        "hits": 17
+    },
+    "i'm dr sheldon cooper": {
+        "character": "Sheldon",
+        "confidence": 1.0,  # 12/12
+        "hits": 12
+    },
+    "my mother had me tested": {
+        "character": "Sheldon",
+        "confidence": 1.0,  # 4/4
+        "hits": 4
+    },
+    "you're in my spot": {
+        "character": "Sheldon",
+        "confidence": 1.0,  # 4/4
+        "hits": 4
+    },
 }
+MIN_HITS = 4
+
+
+def _tokens(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def _compile(table):
+    # Longest phrases first so a long phrase beats any shorter overlap
+    phrases = sorted(table, key=lambda p: len(_tokens(p)), reverse=True)
+    alternatives = [r"\W+".join(re.escape(t) for t in _tokens(p)) for p in phrases]
+    pattern = re.compile(r"\b(?:" + "|".join(alternatives) + r")\b", re.IGNORECASE)
+    by_tokens = {" ".join(_tokens(p)): table[p] | {"phrase": p} for p in phrases}
+    return pattern, by_tokens
+
+
+# Built once at import; one regex scan per query covers the whole table
+_PATTERN, _BY_TOKENS = _compile(CATCHPHRASES)
+
+
+def match_catchphrase(text):
+    """Return `{"phrase", "character", "confidence"}` for the strongest hit, or None.
+
+    Lines that hit catchphrases of different characters are ambiguous and
+    return None.
+    """
+    hits = [_BY_TOKENS[" ".join(_tokens(m.group(0)))] for m in _PATTERN.finditer(text)]
+    if not hits or len({h["character"] for h in hits}) > 1:
+        return None
+    return dict(max(hits, key=lambda h: h["confidence"]))
+
+
+def measure(texts, characters, table=CATCHPHRASES):
+    """`{phrase: (speaker_hits, hits)}`: how often each phrase's character says it in the data."""
+    counts = {}
+    for phrase, entry in table.items():
+        pattern = re.compile(r"\b" + r"\W+".join(re.escape(t) for t in _tokens(phrase)) + r"\b", re.IGNORECASE)
+        speakers = [c for t, c in zip(texts, characters) if isinstance(t, str) and pattern.search(t)]
+        counts[phrase] = (sum(c == entry["character"] for c in speakers), len(speakers))
+    return counts
+
+
+def main(data_path="data/processed/dialogues.arrow"):
+    """Print each phrase's measured precision; returns False if any entry disagrees with the data."""
+    import columnar
+
+    df = columnar.read_dialogues(data_path, columns=["character", "text"])
+    ok = True
+    for phrase, (speaker_hits, hits) in measure(df["text"].tolist(), df["character"].astype(str).tolist()).items():
+        precision = speaker_hits / hits if hits else 0.0
+        entry = CATCHPHRASES[phrase]
+        good = hits >= MIN_HITS and abs(precision - entry["confidence"]) < 0.01
+        ok &= good
+        print(f"{'✓' if good else '✗'} {phrase!r}: {entry['character']} {speaker_hits}/{hits} = {precision:.2f} "
+              f"(table {entry['confidence']})")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check catchphrase confidences against the dialogue data.")
+    parser.add_argument("--data", dest="data_path", default="data/processed/dialogues.arrow")
+    args = parser.parse_args()
+    raise SystemExit(0 if main(**vars(args)) else 1)
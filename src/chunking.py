@@ -1,97 +1,243 @@
-import pandas as pd
 from pathlib import Path
 from langchain_core.documents import Document
+import argparse
+import json
 import pickle
 
-DATA_PATH = Path("data/processed/dialogues.csv")
-OUT_PATH = Path("data/processed/documents.pkl")
+import columnar
 
+DATA_PATH = Path("data/processed/dialogues.arrow")
+# Arrow IPC: text, dictionary-encoded character and numeric metadata columns
+OUT_PATH = Path("data/processed/documents.arrow")
+
+TOKENIZER_MODEL = "sentence-transformers/all-mpnet-base-v2"
+# all-mpnet-base-v2 encodes at most 384 tokens, including [CLS] and [SEP]
+MAX_SEQ_LENGTH = 384
+SPECIAL_TOKENS = 2
+
+
+def lines_by_character(df):
+    """Yield `(character, lines)` in one grouping pass, characters in order of first appearance."""
+    # observed: a categorical `character` column must not yield empty groups
+    for character, texts in df.groupby('character', sort=False, observed=True)['text']:
+        yield character, texts.tolist()
+
+
+def chunk_ranges(n_lines, chunk_size=10, overlap=3):
+    """`(start, end)` line ranges of the overlapping chunks of one character."""
+    return [(i, min(i + chunk_size, n_lines)) for i in range(0, n_lines, chunk_size - overlap)]
 
-def create_chunked_documents(df, chunk_size=10, overlap=3):
 
-    documents = []
-    
-    for character in df['character'].unique():
-        char_df = df[df['character'] == character].reset_index(drop=True)
-        
-        for i in range(0, len(char_df), chunk_size - overlap):
-            chunk = char_df.iloc[i:i + chunk_size]
-            
-            if len(chunk) == 0:
-                continue
-            
-            combined_text = " ".join(chunk['text'].values)
-            
-            doc = Document(
-                page_content=combined_text,
+def context_ranges(n_lines, window_size=5):
+    """`(start, end)` line ranges of the context window around each line of one character."""
+    return [(max(0, i - window_size), min(n_lines, i + window_size + 1)) for i in range(n_lines)]
+
+
+def iter_chunked_documents(df, chunk_size=10, overlap=3):
+    """Yield overlapping chunks of each character's consecutive lines."""
+    for character, lines in lines_by_character(df):
+        for i, end in chunk_ranges(len(lines), chunk_size, overlap):
+            chunk = lines[i:end]
+
+            yield Document(
+                page_content=" ".join(chunk),
                 metadata={
                     "character": character,
                     "num_lines": len(chunk),
                     "start_idx": i
                 }
             )
-            documents.append(doc)
-    
-    return documents
 
 
-def create_contextual_documents(df, window_size=5):
-    documents = []
-    
-    for character in df['character'].unique():
-        char_df = df[df['character'] == character].reset_index(drop=True)
-        
-        for idx, row in char_df.iterrows():
-            start_idx = max(0, idx - window_size)
-            end_idx = min(len(char_df), idx + window_size + 1)
-            
-            context_lines = char_df.iloc[start_idx:end_idx]['text'].tolist()
-            
-            main_text = row['text']
-            context_text = " ".join(context_lines)
-            
-            combined_text = f"{main_text} {context_text}"
-            
-            doc = Document(
-                page_content=combined_text,
+def iter_contextual_documents(df, window_size=5):
+    """Yield one document per line: the line followed by its surrounding lines."""
+    for character, lines in lines_by_character(df):
+        for idx, (start, end) in enumerate(context_ranges(len(lines), window_size)):
+            main_text = lines[idx]
+            context_lines = lines[start:end]
+
+            yield Document(
+                page_content=f"{main_text} {' '.join(context_lines)}",
                 metadata={
                     "character": character,
                     "main_line": main_text,
                     "context_size": len(context_lines)
                 }
             )
-            documents.append(doc)
-    
-    return documents
 
 
-def main():
-    df = pd.read_csv(DATA_PATH)
-    
+def load_tokenizer(model_name=TOKENIZER_MODEL):
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(model_name)
+
+
+def _token_counts(tokenizer, texts):
+    return [len(ids) for ids in tokenizer(list(texts), add_special_tokens=False)["input_ids"]]
+
+
+def iter_token_packed_documents(df, tokenizer, max_tokens=MAX_SEQ_LENGTH, token_overlap=64):
+    """Yield chunks of whole consecutive lines packed up to the encoder's token limit.
+
+    Each chunk holds as many lines as fit in `max_tokens` (minus the special
+    tokens); the next chunk starts with the trailing lines that fit in
+    `token_overlap`. A single line longer than the budget becomes its own
+    (truncated) chunk.
+    """
+    budget = max_tokens - SPECIAL_TOKENS
+    for character, lines in lines_by_character(df):
+        counts = _token_counts(tokenizer, lines)
+        start = 0
+        while start < len(lines):
+            end, used = start, 0
+            while end < len(lines) and (end == start or used + counts[end] <= budget):
+                used += counts[end]
+                end += 1
+
+            yield Document(
+                page_content=" ".join(lines[start:end]),
+                metadata={
+                    "character": character,
+                    "num_lines": end - start,
+                    "start_idx": start,
+                    "num_tokens": used
+                }
+            )
+            if end == len(lines):
+                break
+
+            # Step back over whole lines that fit in the overlap, always moving forward
+            next_start, overlap = end, 0
+            while next_start - 1 > start and overlap + counts[next_start - 1] <= token_overlap:
+                next_start -= 1
+                overlap += counts[next_start]
+            start = next_start
+
+
+def truncation_report(texts, tokenizer, max_tokens=MAX_SEQ_LENGTH, batch_size=1024):
+    """How many documents, and what share of their tokens, the encoder would cut off."""
+    budget = max_tokens - SPECIAL_TOKENS
+    report = {"documents": 0, "truncated_documents": 0, "tokens": 0, "dropped_tokens": 0}
+
+    def tally(batch):
+        for count in _token_counts(tokenizer, batch):
+            report["documents"] += 1
+            report["tokens"] += count
+            if count > budget:
+                report["truncated_documents"] += 1
+                report["dropped_tokens"] += count - budget
+
+    batch = []
+    for text in texts:
+        batch.append(text)
+        if len(batch) == batch_size:
+            tally(batch)
+            batch = []
+    if batch:
+        tally(batch)
+    report["dropped_fraction"] = round(report["dropped_tokens"] / report["tokens"], 4) if report["tokens"] else 0.0
+    return report
+
+
+def _print_report(label, report):
+    print(f"   {label}: {report['truncated_documents']}/{report['documents']} documents truncated, "
+          f"{report['dropped_tokens']}/{report['tokens']} tokens dropped ({report['dropped_fraction']:.1%})")
+
+
+def create_chunked_documents(df, chunk_size=10, overlap=3):
+    return list(iter_chunked_documents(df, chunk_size, overlap))
+
+
+def create_contextual_documents(df, window_size=5):
+    return list(iter_contextual_documents(df, window_size))
+
+
+def write_documents(documents, path=OUT_PATH, characters=None):
+    """Stream documents to an Arrow IPC file (or `.jsonl`); returns how many were written.
+
+    `characters` (every character the documents may name) is required for
+    the Arrow format, whose `character` column is dictionary-encoded.
+    """
+    path = Path(path)
+    if path.suffix != ".jsonl":
+        return columnar.write_documents(documents, path, characters)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for doc in documents:
+            f.write(json.dumps({"page_content": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False))
+            f.write("\n")
+            count += 1
+    return count
+
+
+def iter_documents(path=OUT_PATH):
+    """Lazily read documents written by `write_documents` (or a legacy pickled list)."""
+    path = Path(path)
+    if path.suffix == ".arrow":
+        for record in columnar.iter_document_records(path):
+            yield Document(page_content=record.pop("text"), metadata=record)
+        return
+    if path.suffix == ".pkl":
+        with open(path, "rb") as f:
+            yield from pickle.load(f)
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield Document(page_content=record["page_content"], metadata=record["metadata"])
+
+
+def main(strategy="chunked", chunk_size=15, overlap=5, window_size=5, max_tokens=MAX_SEQ_LENGTH, token_overlap=64,
+         model=TOKENIZER_MODEL):
+    df = columnar.read_dialogues(DATA_PATH, columns=["character", "text"])
+
     print(f"Loaded {len(df)} dialogue lines")
     print(f"Characters: {df['character'].nunique()}")
-    
-    # Strategy 1: Chunked (better for general character voice)
-    documents = create_chunked_documents(df, chunk_size=15, overlap=5)
-    
-    # Strategy 2: Contextual (better for specific line matching)
-    # documents = create_contextual_documents(df, window_size=5)
-    
-    OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUT_PATH, "wb") as f:
-        pickle.dump(documents, f)
-    
+
+    if strategy == "chunked":
+        # Strategy 1: Chunked (better for general character voice)
+        documents = iter_chunked_documents(df, chunk_size=chunk_size, overlap=overlap)
+    elif strategy == "contextual":
+        # Strategy 2: Contextual (better for specific line matching)
+        documents = iter_contextual_documents(df, window_size=window_size)
+    else:
+        # Strategy 3: Whole lines packed to the encoder's token limit, so nothing is truncated
+        tokenizer = load_tokenizer(model)
+        print(f"\n✂️  Truncation at {max_tokens} tokens ({model}):")
+        _print_report(f"{chunk_size}-line chunks", truncation_report(
+            (d.page_content for d in iter_chunked_documents(df, chunk_size, overlap)), tokenizer, max_tokens
+        ))
+        _print_report("token-packed chunks", truncation_report(
+            (d.page_content for d in iter_token_packed_documents(df, tokenizer, max_tokens, token_overlap)),
+            tokenizer, max_tokens
+        ))
+        documents = iter_token_packed_documents(df, tokenizer, max_tokens, token_overlap)
+
+    count = write_documents(documents, OUT_PATH, characters=df["character"].cat.categories)
+
     print(f"\n✅ Document creation complete")
-    print(f"Total documents created: {len(documents)}")
+    print(f"Total documents created: {count}")
     print(f"Saved to: {OUT_PATH}")
-    
+
     # Show sample
     print(f"\n📝 Sample document:")
-    sample = documents[0]
+    sample = next(iter_documents(OUT_PATH))
     print(f"Character: {sample.metadata['character']}")
     print(f"Content: {sample.page_content[:200]}...")
     print(f"Metadata: {sample.metadata}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Turn cleaned dialogue into documents for build_index.py.")
+    parser.add_argument("--strategy", default="chunked", choices=("chunked", "contextual", "tokens"))
+    parser.add_argument("--chunk-size", type=int, default=15)
+    parser.add_argument("--overlap", type=int, default=5)
+    parser.add_argument("--window-size", type=int, default=5, help="Lines either side for --strategy contextual")
+    parser.add_argument("--max-tokens", type=int, default=MAX_SEQ_LENGTH,
+                        help="Encoder sequence limit for --strategy tokens")
+    parser.add_argument("--token-overlap", type=int, default=64,
+                        help="Tokens of whole trailing lines repeated in the next chunk (--strategy tokens)")
+    parser.add_argument("--model", default=TOKENIZER_MODEL, help="Model whose tokenizer --strategy tokens uses")
+    args = parser.parse_args()
+    main(**vars(args))
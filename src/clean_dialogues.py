@@ -2,10 +2,12 @@ import pandas as pd
 import re
 from pathlib import Path
 
+import columnar
 from character_normalisation import normalize_character
 
 RAW_PATH = Path("data/raw/1_10_seasons_tbbt.csv")
-OUT_PATH = Path("data/processed/dialogues.csv")
+# Arrow IPC with a dictionary-encoded character column (see columnar)
+OUT_PATH = Path("data/processed/dialogues.arrow")
 
 
 def clean_dialogue_text(text: str):
@@ -57,8 +59,7 @@ def main():
 
     df = df[["character", "text"]].reset_index(drop=True)
 
-    OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
-    df.to_csv(OUT_PATH, index=False)
+    columnar.write_dialogues(df, OUT_PATH)
 
     print(f"✅ Cleaned dataset saved: {len(df)} rows")
 
@@ -0,0 +1,118 @@
+"""Arrow IPC files passed between the preprocessing stages.
+
+    dialogues.arrow   character (dictionary), text            clean_dialogues.py -> chunking.py
+    documents.arrow   text, character (dictionary), metadata  chunking.py -> build_index.py
+
+Both are uncompressed Arrow IPC (Feather v2) files, so a reader memory-maps
+them and only touches the columns it asks for; nothing is parsed. The
+`character` columns are dictionary-encoded: each row stores a small integer
+code into one table of names, which pandas reads back as a `Categorical`.
+Documents are written and read record batch by record batch, so a corpus is
+never held in memory as a list.
+"""
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+BATCH_ROWS = 8192
+
+
+def write_dialogues(df, path):
+    """Write a `character`/`text` frame with a dictionary-encoded `character` column."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df = df.astype({"character": "category"})
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    feather.write_feather(table, path, compression="uncompressed")
+    return len(df)
+
+
+def read_dialogues(path, columns=None):
+    """Read dialogue columns, memory-mapped; a legacy `.csv` (or its `.csv` sibling) is parsed instead."""
+    path = Path(path)
+    if path.suffix != ".csv" and not path.exists() and path.with_suffix(".csv").exists():
+        path = path.with_suffix(".csv")
+    if path.suffix == ".csv":
+        df = pd.read_csv(path, usecols=columns)
+        return df.astype({"character": "category"}) if "character" in df else df
+    return feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+
+
+def _record_batch(texts, codes, characters, meta, schema):
+    arrays = [
+        pa.array(texts, type=pa.string()),
+        pa.DictionaryArray.from_arrays(pa.array(codes, type=pa.int16()), characters),
+    ]
+    names = ["text", "character"]
+    for name, values in meta.items():
+        arrays.append(pa.array(values, type=None if schema is None else schema.field(name).type))
+        names.append(name)
+    if schema is None:
+        return pa.RecordBatch.from_arrays(arrays, names=names)
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_documents(documents, path, characters, batch_rows=BATCH_ROWS):
+    """Stream LangChain `Document`s to an Arrow IPC file; returns how many were written.
+
+    `characters` is the full character table: every batch shares it as the
+    dictionary of the `character` column, as the IPC file format requires.
+    Metadata fields are taken from the first document; later documents
+    missing one get a null.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    characters = pa.array(list(characters), type=pa.string())
+    lookup = {name: i for i, name in enumerate(characters.to_pylist())}
+
+    writer = schema = fields = None
+    texts, codes, meta = [], [], {}
+    count = 0
+
+    def flush():
+        nonlocal writer, schema
+        batch = _record_batch(texts, codes, characters, meta, schema)
+        if writer is None:
+            schema = batch.schema
+            writer = pa.ipc.new_file(str(path), schema)
+        writer.write_batch(batch)
+        texts.clear()
+        codes.clear()
+        for values in meta.values():
+            values.clear()
+
+    try:
+        for doc in documents:
+            if fields is None:
+                fields = [name for name in doc.metadata if name != "character"]
+                meta = {name: [] for name in fields}
+            character = doc.metadata.get("character")
+            if character not in lookup:
+                raise ValueError(f"Character {character!r} is not in the character table")
+            texts.append(doc.page_content)
+            codes.append(lookup[character])
+            for name in fields:
+                meta[name].append(doc.metadata.get(name))
+            count += 1
+            if len(texts) == batch_rows:
+                flush()
+        if texts or writer is None:
+            flush()
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def iter_document_records(path, columns=None):
+    """Yield one dict per document (nulls dropped), reading a record batch at a time."""
+    with pa.memory_map(str(path)) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if columns is not None:
+                batch = batch.select(columns)
+            for record in batch.to_pylist():
+                yield {name: value for name, value in record.items() if value is not None}
@@ -0,0 +1,199 @@
+"""Streaming, resumable document encoding for build_index.py.
+
+Texts are encoded batch by batch, optionally across a pool of encoder
+processes, and written straight into a `.npy` memmap, so the corpus never
+has to fit in memory as vectors. After every batch the memmap is flushed
+and a small JSON checkpoint records how many rows are done; rerunning the
+same build (same model, same texts) resumes from there, and once the file
+is complete the checkpoint is kept as a marker so an unchanged corpus is
+not encoded again at all. Batches are consumed in order, so callers can
+stream them into an index as they land.
+"""
+from collections import deque
+from pathlib import Path
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from encoders import make_embeddings
+
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+PARTIAL_SUFFIX = ".partial"
+
+# Filled in each encoder process by _init_worker
+_encoder = None
+
+
+def make_document_encoder(model_name):
+    # Documents are always encoded with the full-precision PyTorch model,
+    # whatever ENCODER_BACKEND the API serves queries with
+    return make_embeddings(model_name, "torch")
+
+
+def _init_worker(model_name, threads):
+    global _encoder
+    if threads:
+        # Split the cores between workers instead of every process using all of them
+        import torch
+        torch.set_num_threads(threads)
+    _encoder = make_document_encoder(model_name)
+
+
+def document_encoder(model_name):
+    """The in-process encoder, loading it if this process has none yet."""
+    if _encoder is None:
+        _init_worker(model_name, 0)
+    return _encoder
+
+
+def _encode_batch(texts):
+    return np.asarray(_encoder.embed_documents(texts), dtype=np.float32)
+
+
+class _Done:
+    """Stand-in for a future when encoding in-process."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+def corpus_fingerprint(model_name, texts):
+    digest = hashlib.sha1(model_name.encode("utf-8"))
+    for text in texts:
+        digest.update(b"\0" + text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _write_checkpoint(path, state):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def encode_corpus(texts, model_name, out_path, store=None, workers=0, batch_size=256, on_batch=None):
+    """Encode `texts` in order into an `[n, dim]` float32 .npy file at `out_path`.
+
+    Args:
+        texts: Sequence of document texts
+        model_name: sentence-transformers model to encode with
+        out_path: Destination `.npy`; written as `<out_path>.partial` and
+            renamed when complete, so readers never see a half-written file
+        store: Optional `EmbeddingStore`; cached vectors are reused and new
+            ones written back
+        workers: Encoder processes (0 encodes in this process)
+        batch_size: Texts per batch
+        on_batch: Called as `on_batch(start, vectors)` for every batch in
+            order, including rows restored from a checkpoint
+
+    Returns:
+        The vectors, memory-mapped read-only from `out_path`
+    """
+    out_path = Path(out_path)
+    partial = out_path.with_name(out_path.name + PARTIAL_SUFFIX)
+    checkpoint_path = out_path.with_name(out_path.name + CHECKPOINT_SUFFIX)
+    n = len(texts)
+    fingerprint = corpus_fingerprint(model_name, texts)
+
+    state = {}
+    if checkpoint_path.exists():
+        with open(checkpoint_path, encoding="utf-8") as f:
+            state = json.load(f)
+    current = state.get("fingerprint") == fingerprint and state.get("num_rows") == n
+
+    if current and state.get("complete") and out_path.exists():
+        print(f"✓ {out_path} is up to date ({n} documents)")
+        vectors = np.load(out_path, mmap_mode="r")
+        if on_batch is not None:
+            for start in range(0, n, batch_size):
+                on_batch(start, np.asarray(vectors[start:start + batch_size]))
+        return vectors
+
+    out, done = None, 0
+    if current and partial.exists():
+        out = np.lib.format.open_memmap(partial, mode="r+")
+        done = state["rows_done"]
+        print(f"⏯️  Resuming from checkpoint: {done}/{n} documents already encoded")
+        if on_batch is not None:
+            for start in range(0, done, batch_size):
+                on_batch(start, np.asarray(out[start:min(start + batch_size, done)]))
+
+    if workers:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        # spawn: forked copies of an already-initialised torch runtime can deadlock
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker, initargs=(model_name, threads))
+    else:
+        pool = None
+        if done < n:
+            _init_worker(model_name, 0)
+
+    def submit(start):
+        batch = texts[start:start + batch_size]
+        cached = store.get_many(batch) if store is not None else [None] * len(batch)
+        missing = [t for t, v in zip(batch, cached) if v is None]
+        if not missing:
+            future = _Done(None)
+        elif pool is not None:
+            future = pool.submit(_encode_batch, missing)
+        else:
+            future = _Done(_encode_batch(missing))
+        return start, batch, cached, missing, future
+
+    t0 = time.perf_counter()
+    encoded = reused = 0
+    starts = iter(range(done, n, batch_size))
+    # Bound the work in flight so memory stays flat however large the corpus is
+    pending = deque(submit(s) for _, s in zip(range(max(2 * workers, 1)), starts))
+    try:
+        while pending:
+            start, batch, cached, missing, future = pending.popleft()
+            fresh = future.result()
+            if fresh is not None:
+                if store is not None:
+                    store.put_many(missing, fresh)
+                fresh = iter(fresh)
+            vectors = np.vstack([next(fresh) if v is None else v for v in cached]).astype(np.float32)
+            encoded += len(missing)
+            reused += len(batch) - len(missing)
+
+            if out is None:
+                out = np.lib.format.open_memmap(partial, mode="w+", dtype=np.float32, shape=(n, vectors.shape[1]))
+            out[start:start + len(batch)] = vectors
+            out.flush()
+            _write_checkpoint(checkpoint_path, {
+                "fingerprint": fingerprint, "num_rows": n, "rows_done": start + len(batch),
+            })
+            if on_batch is not None:
+                on_batch(start, vectors)
+
+            rows = encoded + reused
+            if (rows // batch_size) % 10 == 0 or start + len(batch) == n:
+                rate = encoded / max(time.perf_counter() - t0, 1e-9)
+                print(f"   {start + len(batch)}/{n} documents ({encoded} encoded, {reused} cached, {rate:.1f} docs/sec)")
+
+            next_start = next(starts, None)
+            if next_start is not None:
+                pending.append(submit(next_start))
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    if out is None:
+        raise ValueError("No documents to encode")
+    elapsed = time.perf_counter() - t0
+    print(f"⚡ Encoded {encoded} documents in {elapsed:.1f}s ({encoded / max(elapsed, 1e-9):.1f} docs/sec), "
+          f"reused {reused + done} cached/checkpointed")
+
+    del out
+    os.replace(partial, out_path)
+    _write_checkpoint(checkpoint_path, {"fingerprint": fingerprint, "num_rows": n, "rows_done": n, "complete": True})
+    return np.load(out_path, mmap_mode="r")
@@ -0,0 +1,188 @@
+"""Columnar, memory-mappable store for the documents behind the FAISS index.
+
+Row `i` of the store describes vector `i` of the index. On disk:
+
+    doc_characters.json   character table (id -> name)
+    doc_char_ids.npy      uint8  [n]     character id per document
+    doc_offsets.npy       int32  [n + 1] byte offsets into doc_text.bin
+    doc_text.bin          UTF-8 text of every document, concatenated
+    doc_meta_<name>.npy   int32  [n]     numeric metadata (-1 where absent)
+
+Everything is opened with `mmap_mode="r"`, so loading costs nothing up front
+and worker processes share the pages. Text is only decoded for the rows a
+caller actually asks for.
+"""
+import json
+from array import array
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+
+CHARACTERS_FILE = "doc_characters.json"
+CHAR_IDS_FILE = "doc_char_ids.npy"
+OFFSETS_FILE = "doc_offsets.npy"
+TEXT_FILE = "doc_text.bin"
+META_PREFIX = "doc_meta_"
+
+MAX_CHARACTERS = 255
+MAX_TEXT_BYTES = 2 ** 31 - 1
+
+
+class ArrayDocStoreWriter:
+    """Append documents one at a time; only the fixed-width columns stay in memory."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Metadata columns of an earlier build (possibly another strategy) must not outlive it
+        for stale in self.directory.glob(f"{META_PREFIX}*.npy"):
+            stale.unlink()
+        self._text = open(self.directory / TEXT_FILE, "wb")
+        self._offsets = array("i", [0])
+        self._char_ids = array("B")
+        self._meta = {}
+        self._characters = {}
+
+    def add(self, text, character, metadata=None):
+        char_id = self._characters.setdefault(character, len(self._characters))
+        if char_id >= MAX_CHARACTERS:
+            raise ValueError(f"More than {MAX_CHARACTERS} characters do not fit in a uint8 column")
+
+        data = text.encode("utf-8")
+        end = self._offsets[-1] + len(data)
+        if end > MAX_TEXT_BYTES:
+            raise ValueError("Document text exceeds the int32 offset range")
+        self._text.write(data)
+        self._offsets.append(end)
+        self._char_ids.append(char_id)
+
+        row = len(self._char_ids) - 1
+        for name, value in (metadata or {}).items():
+            # Only numeric fields are stored; strings can be derived from the text
+            if isinstance(value, bool) or not isinstance(value, (int, np.integer)):
+                continue
+            column = self._meta.get(name)
+            if column is None:
+                column = self._meta[name] = array("i", [-1] * row)
+            column.append(int(value))
+
+        for column in self._meta.values():
+            if len(column) < row + 1:
+                column.append(-1)
+
+    def add_document(self, doc):
+        """Append a LangChain `Document` with a `character` metadata field."""
+        self.add(doc.page_content, doc.metadata.get("character"), doc.metadata)
+
+    def close(self):
+        self._text.close()
+        np.save(self.directory / OFFSETS_FILE, np.frombuffer(self._offsets, dtype=np.int32))
+        np.save(self.directory / CHAR_IDS_FILE, np.frombuffer(self._char_ids, dtype=np.uint8))
+        for name, column in self._meta.items():
+            np.save(self.directory / f"{META_PREFIX}{name}.npy", np.frombuffer(column, dtype=np.int32))
+        characters = sorted(self._characters, key=self._characters.get)
+        with open(self.directory / CHARACTERS_FILE, "w", encoding="utf-8") as f:
+            json.dump(characters, f)
+        return len(self._char_ids)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class TextColumn(Sequence):
+    """Read-only sequence over a store's texts, decoded only when accessed."""
+
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return len(self._store)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self._store.text(row) for row in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError(item)
+        return self._store.text(item)
+
+
+class ArrayDocStore:
+    def __init__(self, characters, char_ids, offsets, text, meta):
+        self.characters = characters
+        self.char_ids = char_ids
+        self.offsets = offsets
+        self._text = text
+        self.meta = meta
+
+    @classmethod
+    def write(cls, directory, documents):
+        """Write an iterable of LangChain `Document`s and return the row count."""
+        writer = ArrayDocStoreWriter(directory)
+        for doc in documents:
+            writer.add_document(doc)
+        return writer.close()
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        directory = Path(directory)
+        mode = "r" if mmap else None
+        with open(directory / CHARACTERS_FILE, encoding="utf-8") as f:
+            characters = json.load(f)
+        char_ids = np.load(directory / CHAR_IDS_FILE, mmap_mode=mode)
+        offsets = np.load(directory / OFFSETS_FILE, mmap_mode=mode)
+        text_path = directory / TEXT_FILE
+        if text_path.stat().st_size == 0:
+            text = np.zeros(0, dtype=np.uint8)
+        elif mmap:
+            text = np.memmap(text_path, dtype=np.uint8, mode="r")
+        else:
+            text = np.fromfile(text_path, dtype=np.uint8)
+        meta = {
+            p.name[len(META_PREFIX):-len(".npy")]: np.load(p, mmap_mode=mode)
+            for p in sorted(directory.glob(f"{META_PREFIX}*.npy"))
+        }
+        for name, column in meta.items():
+            if len(column) != len(char_ids):
+                raise ValueError(f"Metadata column {name!r} has {len(column)} rows but the store has "
+                                 f"{len(char_ids)}; rebuild the index")
+        return cls(characters, char_ids, offsets, text, meta)
+
+    @staticmethod
+    def exists(directory):
+        return (Path(directory) / CHAR_IDS_FILE).exists()
+
+    def __len__(self):
+        return len(self.char_ids)
+
+    @property
+    def texts(self):
+        return TextColumn(self)
+
+    def character_names(self):
+        """Character name of every row, as an object array."""
+        return np.asarray(self.characters, dtype=object)[np.asarray(self.char_ids)]
+
+    def character(self, row):
+        return self.characters[self.char_ids[row]]
+
+    def text(self, row, max_chars=None):
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        if max_chars is not None:
+            # A UTF-8 character is at most 4 bytes, so this is enough to slice from
+            end = min(end, start + 4 * max_chars)
+        text = bytes(self._text[start:end]).decode("utf-8", errors="ignore")
+        return text if max_chars is None else text[:max_chars]
+
+    def metadata(self, row):
+        out = {"character": self.character(row)}
+        for name, column in self.meta.items():
+            value = int(column[row])
+            if value != -1:
+                out[name] = value
+        return out
@@ -0,0 +1,154 @@
+"""Disk-backed embedding store shared by every worker on a host.
+
+Vectors are stored as float16 blobs in SQLite (WAL mode, so concurrent
+readers never block and writers only briefly serialize), keyed by a hash of
+the model name and the text. The store remembers which model wrote it and is
+wiped on open when that changes, so a new `MODEL_NAME` never reads vectors
+from the old one.
+
+`build_index.py` uses one float32 store per model as a content-addressed
+cache of document vectors, so rebuilds only encode new or changed chunks.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+SCHEMA_VERSION = "1"
+
+
+class EmbeddingStore:
+    def __init__(self, path, model_name, dtype=np.float16):
+        self.path = str(path)
+        self.model_name = model_name
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def _connect(self):
+        # Connections must not cross a fork, so reopen in each new process
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+
+        parent = os.path.dirname(self.path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vec BLOB NOT NULL) WITHOUT ROWID"
+        )
+
+        fingerprint = f"{SCHEMA_VERSION}:{self.model_name}"
+        if self.dtype != np.float16:
+            fingerprint += f":{self.dtype.name}"
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'model'").fetchone()
+            if row is None or row[0] != fingerprint:
+                conn.execute("DELETE FROM embeddings")
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('model', ?)", (fingerprint,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._conn = conn
+        self._pid = os.getpid()
+        return conn
+
+    def key(self, text):
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode("utf-8")).digest()
+
+    def get_many(self, texts):
+        """Return a float32 vector (or None) for each text."""
+        if not texts:
+            return []
+        keys = [self.key(t) for t in texts]
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            # Stay well under SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                for k, blob in conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({placeholders})", part
+                ):
+                    found[bytes(k)] = blob
+
+        out = []
+        for k in keys:
+            blob = found.get(k)
+            if blob is None:
+                self.misses += 1
+                out.append(None)
+            else:
+                self.hits += 1
+                out.append(np.frombuffer(blob, dtype=self.dtype).astype(np.float32))
+        return out
+
+    def put_many(self, texts, vectors):
+        rows = [
+            (self.key(t), np.asarray(v, dtype=self.dtype).tobytes())
+            for t, v in zip(texts, vectors)
+        ]
+        if not rows:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN")
+            try:
+                conn.executemany("INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)", rows)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        self.writes += len(rows)
+
+    def prune(self, texts):
+        """Delete every vector whose text is not in `texts`; return how many were removed."""
+        keys = [(self.key(t),) for t in set(texts)]
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN")
+            try:
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep (key BLOB PRIMARY KEY) WITHOUT ROWID")
+                conn.execute("DELETE FROM keep")
+                conn.executemany("INSERT OR IGNORE INTO keep (key) VALUES (?)", keys)
+                removed = conn.execute(
+                    "DELETE FROM embeddings WHERE key NOT IN (SELECT key FROM keep)"
+                ).rowcount
+                conn.execute("DELETE FROM keep")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return removed
+
+    def __len__(self):
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "model": self.model_name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
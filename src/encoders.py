@@ -0,0 +1,26 @@
+"""Sentence encoders shared by index builds, the API and the benchmarks.
+
+Every backend exposes LangChain's `embed_documents` / `embed_query` and
+returns unit-normalised vectors. Heavy dependencies are imported only for
+the backend actually requested.
+"""
+
+# "torch" (sentence-transformers), "onnx" or "onnx-int8" (ONNX Runtime)
+ENCODER_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def make_embeddings(model_name, backend="torch"):
+    """Create an encoder for `model_name` with one of `ENCODER_BACKENDS`."""
+    if backend == "torch":
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+        return HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={'device': 'cpu'},  # Use 'cuda' if you have GPU
+            encode_kwargs={'normalize_embeddings': True}  # Important for cosine similarity
+        )
+    if backend in ("onnx", "onnx-int8"):
+        from onnx_encoder import OnnxEmbeddings
+
+        return OnnxEmbeddings(model_name, quantize=backend == "onnx-int8")
+    raise ValueError(f"Unknown encoder backend: {backend} (expected one of {ENCODER_BACKENDS})")
@@ -0,0 +1,137 @@
+"""
+Measure an approximate FAISS index against exact search.
+
+Samples dialogue lines as queries, searches both the built index and an exact
+flat index over the stored full-precision vectors, and reports recall@k,
+character-prediction agreement and search latency for a sweep of `nprobe`
+(IVF) or `efSearch` (HNSW) values. Quantized and dimension-reduced indexes
+are also measured with full-precision re-ranking of the shortlist, alongside
+their size on disk.
+
+Run from the repository root after build_index.py, e.g.:
+    python src/evaluate_index.py --queries 500 --k 20 --sweep 1,4,16,64
+"""
+from pathlib import Path
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+import columnar
+import index_factory
+from doc_store import ArrayDocStore
+from encoders import ENCODER_BACKENDS, make_embeddings
+from predict_character import (
+    ENCODER_BACKEND, INDEX_DIR, VectorStore, compute_character_scores, read_faiss_index
+)
+
+DATA_PATH = Path("data/processed/dialogues.arrow")
+
+
+def sample_queries(n, seed=0):
+    df = columnar.read_dialogues(DATA_PATH, columns=["text"])
+    return df["text"].sample(n=min(n, len(df)), random_state=seed).tolist()
+
+
+def predicted_characters(vectorstore, distances, rows, k, score_method):
+    """Arg-max character column per query (-1 when nothing scored)."""
+    char_ids = vectorstore.neighbour_characters(rows)
+    scores = compute_character_scores(char_ids, distances, score_method, top_k=k)
+    return np.where(scores.sum(axis=1) > 0, scores.argmax(axis=1), -1)
+
+
+def recall_at_k(approx_rows, exact_rows):
+    """Mean fraction of the exact top-k that the approximate search also returned."""
+    recalls = []
+    for approx, exact in zip(approx_rows, exact_rows):
+        truth = set(exact[exact >= 0].tolist())
+        if truth:
+            recalls.append(len(truth & set(approx[approx >= 0].tolist())) / len(truth))
+    return float(np.mean(recalls)) if recalls else 0.0
+
+
+def timed_search(index, vectors, k):
+    t0 = time.perf_counter()
+    distances, rows = index.search(vectors, k)
+    return distances, rows, (time.perf_counter() - t0) * 1000 / len(vectors)
+
+
+def timed_vectorstore_search(vectorstore, vectors, k):
+    t0 = time.perf_counter()
+    distances, rows = vectorstore.search(vectors, k)
+    return distances, rows, (time.perf_counter() - t0) * 1000 / len(vectors)
+
+
+def main(index_dir=INDEX_DIR, n_queries=500, k=20, sweep=None, score_method="reciprocal_rank_fusion",
+         encoder_backend=ENCODER_BACKEND):
+    index_dir = Path(index_dir)
+    config = index_factory.load_config(index_dir)
+    model_name = config.get("model_name", "sentence-transformers/all-mpnet-base-v2")
+    print(f"📐 Index: {config.get('index_type', 'flat')}, reduce={config.get('reduce', 'none')} ({index_dir})")
+
+    vectors = np.load(index_dir / index_factory.VECTORS_FILE, mmap_mode="r")
+    index = read_faiss_index(index_dir / "index.faiss", mmap=False)
+    docstore = ArrayDocStore.load(index_dir)
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(np.ascontiguousarray(vectors, dtype=np.float32))
+
+    # The same query encoder the API serves, so ONNX / int8 backends can be measured too
+    embeddings = make_embeddings(model_name, encoder_backend)
+    queries = sample_queries(n_queries)
+    query_vectors = np.asarray(embeddings.embed_documents(queries), dtype=np.float32)
+    print(f"🔎 {len(queries)} sampled queries, k={k}, scoring={score_method}, encoder={encoder_backend}")
+
+    projection = index_factory.load_projection(index_dir)
+    vectorstore = VectorStore(embeddings, index, docstore, config, projection=projection)
+    rerank_factor = index_factory.rerank_factor(config)
+    reranked = VectorStore(
+        embeddings, index, docstore, {**config, "rerank_factor": rerank_factor}, vectors, projection
+    )
+    index_mb = (index_dir / "index.faiss").stat().st_size / 2 ** 20
+    print(f"💾 Index size: {index_mb:.1f} MB vs {vectors.nbytes / 2 ** 20:.1f} MB float32 "
+          f"(compression {vectors.nbytes / 2 ** 20 / max(index_mb, 1e-9):.1f}x)")
+    exact_d, exact_r, exact_ms = timed_search(exact, query_vectors, k)
+    exact_pred = predicted_characters(vectorstore, exact_d, exact_r, k, score_method)
+
+    index_type = config.get("index_type", "flat")
+    param = "nprobe" if index_type.startswith("ivf") else "efSearch" if index_type == "hnsw" else None
+    settings = [None]
+    if param:
+        default = index_factory.search_params(config)[param]
+        settings = sorted(set(sweep or []) | {default})
+
+    print(f"\n{'setting':>16} {'recall@k':>9} {'agree':>7} {'ms/query':>9}")
+    print(f"{'exact':>16} {1.0:>9.4f} {1.0:>7.4f} {exact_ms:>9.3f}")
+    report = []
+    for value in settings:
+        if param:
+            index_factory.apply_search_params(index, {param: value})
+        runs = [("", timed_vectorstore_search(vectorstore, query_vectors, k))]
+        if rerank_factor > 1:
+            runs.append((f"+rr{rerank_factor}", timed_vectorstore_search(reranked, query_vectors, k)))
+        for suffix, (d, r, ms) in runs:
+            row = {
+                "setting": (f"{param}={value}" if param else index_type) + suffix,
+                "recall": recall_at_k(r, exact_r),
+                "agreement": float(np.mean(predicted_characters(vectorstore, d, r, k, score_method) == exact_pred)),
+                "ms_per_query": ms,
+            }
+            report.append(row)
+            print(f"{row['setting']:>16} {row['recall']:>9.4f} {row['agreement']:>7.4f} {row['ms_per_query']:>9.3f}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report recall@k and prediction agreement against exact search.")
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    parser.add_argument("--queries", dest="n_queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--sweep", type=lambda s: [int(x) for x in s.split(",") if x],
+                        help="Comma-separated nprobe (IVF) or efSearch (HNSW) values to try")
+    parser.add_argument("--score-method", default="reciprocal_rank_fusion")
+    parser.add_argument("--encoder-backend", default=ENCODER_BACKEND, choices=ENCODER_BACKENDS,
+                        help="Query encoder (default: $ENCODER_BACKEND, as served by the API)")
+    args = parser.parse_args()
+    main(**vars(args))
@@ -0,0 +1,326 @@
+"""In-memory manifest of character images served by the API.
+
+The manifest is built from the curated `frontend/assets/characters/<slug>/`
+galleries, the scraped `frontend/assets/remote/<slug>_<hash>.<ext>` cache and
+the single `frontend/assets/<slug>.svg` fallbacks. Request handlers only ever
+read the manifest; scraping fandom and downloading images happens in a
+background thread so no prediction pays for network I/O.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+import requests
+from bs4 import BeautifulSoup
+
+try:
+    from .character_config import ALLOWED_CHARACTERS
+except Exception:
+    from character_config import ALLOWED_CHARACTERS
+
+ASSETS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'frontend', 'assets'))
+CHARACTERS_DIR = os.path.join(ASSETS_DIR, 'characters')
+REMOTE_DIR = os.path.join(ASSETS_DIR, 'remote')
+
+FANDOM_BASE = 'https://bigbangtheory.fandom.com'
+IMAGE_EXT_RE = re.compile(r'\.(jpg|jpeg|png|gif|webp)(?:\?|$)', re.I)
+REMOTE_FILE_RE = re.compile(r'^(?P<slug>[a-z0-9_]+?)_[0-9a-f]{8}\.(jpg|jpeg|png|gif|webp)$', re.I)
+
+# Seconds between background refreshes and before a failed lookup is retried
+REFRESH_INTERVAL = float(os.environ.get('IMAGE_MANIFEST_REFRESH_SECONDS', 600))
+NEGATIVE_TTL = float(os.environ.get('IMAGE_NEGATIVE_CACHE_SECONDS', 3600))
+SCRAPE_ENABLED = os.environ.get('IMAGE_SCRAPE_ENABLED', '1') != '0'
+
+# slug -> {"local": [...], "remote": [...], "svg": str|None, "urls": [...]}
+# The dict is rebuilt and swapped in whole, so readers never see a partial update.
+_manifest = {}
+# character -> monotonic timestamp of the last failed fandom lookup
+_negative_cache = {}
+# characters requested by the API that had no images at lookup time
+_pending = set()
+_lock = threading.Lock()
+_refresh_thread = None
+_stop_event = threading.Event()
+
+
+def slugify(name, max_len=60):
+    return re.sub(r'[^a-z0-9]+', '_', (name or '').lower())[:max_len]
+
+
+def _list_files(path):
+    try:
+        return sorted(f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f)))
+    except OSError:
+        return []
+
+
+def scan_assets():
+    """Scan the asset directories and return a fresh manifest dict."""
+    manifest = {}
+
+    def entry(slug):
+        return manifest.setdefault(slug, {"local": [], "remote": [], "svg": None, "urls": []})
+
+    if os.path.isdir(CHARACTERS_DIR):
+        for slug in sorted(os.listdir(CHARACTERS_DIR)):
+            char_dir = os.path.join(CHARACTERS_DIR, slug)
+            if not os.path.isdir(char_dir):
+                continue
+            files = _list_files(char_dir)
+            if files:
+                entry(slug)["local"] = [f"/assets/characters/{slug}/{f}" for f in files]
+
+    for fname in _list_files(REMOTE_DIR):
+        m = REMOTE_FILE_RE.match(fname)
+        if m:
+            entry(m.group('slug').lower())["remote"].append(f"/assets/remote/{fname}")
+
+    for fname in _list_files(ASSETS_DIR):
+        if fname.lower().endswith('.svg'):
+            entry(fname[:-4].lower())["svg"] = f"/assets/{fname}"
+
+    # Scraped URLs are not on disk; carry them over from the previous manifest
+    for slug, old in _manifest.items():
+        if old["urls"]:
+            entry(slug)["urls"] = old["urls"]
+
+    return manifest
+
+
+def lookup_images(character_name):
+    """Return image fields for a character straight from the manifest.
+
+    Never touches the network or the filesystem. Characters without any images
+    are queued for the background refresher.
+    """
+    if not character_name:
+        return {}
+
+    entry = _manifest.get(slugify(character_name))
+    out = {}
+    if entry:
+        if entry["local"]:
+            out["local_image"] = random.choice(entry["local"])
+        elif entry["remote"]:
+            out["local_image"] = random.choice(entry["remote"])
+        elif entry["svg"]:
+            out["local_image"] = entry["svg"]
+
+        if entry["urls"]:
+            out["image_urls"] = entry["urls"]
+            out["image"] = entry["urls"][0]
+
+    if not out:
+        with _lock:
+            _pending.add(character_name)
+    return out
+
+
+def fetch_character_images(character_name, max_images=6):
+    """Scrape image URLs for a character from their fandom page."""
+    if not character_name:
+        return []
+
+    page_name = character_name.replace(' ', '_')
+    url = f'{FANDOM_BASE}/wiki/{page_name}'
+
+    try:
+        resp = requests.get(url, timeout=8)
+        if resp.status_code != 200:
+            return []
+
+        soup = BeautifulSoup(resp.text, 'html.parser')
+
+        imgs = []
+        # Prefer JSON-LD and OpenGraph images when available
+        for s in soup.find_all('script', type='application/ld+json'):
+            try:
+                jd = json.loads(s.string or '{}')
+                for key in ('image', 'thumbnailUrl'):
+                    val = jd.get(key)
+                    if isinstance(val, str) and val:
+                        imgs.append(val)
+                # nested mainEntity
+                me = jd.get('mainEntity') or jd.get('about')
+                if isinstance(me, dict):
+                    iv = me.get('image')
+                    if isinstance(iv, str) and iv:
+                        imgs.append(iv)
+            except Exception:
+                continue
+
+        og = soup.find('meta', property='og:image')
+        if og and og.get('content'):
+            imgs.append(og.get('content'))
+
+        def absolute(u):
+            if u.startswith('//'):
+                return 'https:' + u
+            if u.startswith('/'):
+                return FANDOM_BASE + u
+            return u
+
+        # Look for images in the main content area and collect src/srcset
+        for img in soup.select('.mw-parser-output img, .article-table img, figure img'):
+            srcset = img.get('srcset') or ''
+            # prefer data-src (lazy-loaded images), then src, then srcset
+            src = img.get('data-src') or img.get('src') or ''
+            if not src and srcset:
+                src = srcset.split(',')[0].strip().split(' ')[0]
+            if not src:
+                continue
+            src = absolute(src)
+
+            # If this is a Fandom thumbnail URL, reconstruct the original image URL
+            if '/thumb/' in src:
+                prefix, tail = src.split('/thumb/', 1)
+                filename = tail.split('/')[-1].split('?')[0]
+                imgs.append(absolute(prefix + '/' + filename))
+
+            if IMAGE_EXT_RE.search(src):
+                imgs.append(src)
+
+            for part in srcset.split(','):
+                u = absolute(part.strip().split(' ')[0])
+                if IMAGE_EXT_RE.search(u):
+                    imgs.append(u)
+
+        # Deduplicate while preserving order
+        seen = set(); out = []
+        for u in imgs:
+            if u in seen: continue
+            seen.add(u); out.append(u)
+            if len(out) >= max_images: break
+
+        return out
+    except Exception:
+        return []
+
+
+def download_and_cache_image(url, character_name):
+    """Download an image into the remote cache and return its asset path."""
+    raw = url.split('?')[0]
+    _, ext = os.path.splitext(raw)
+    if not IMAGE_EXT_RE.search(ext):
+        ext = '.jpg'
+
+    slug = slugify(character_name or 'char', max_len=40)
+    h = hashlib.md5(url.encode('utf-8')).hexdigest()[:8]
+    fname = f"{slug}_{h}{ext}"
+    out_path = os.path.join(REMOTE_DIR, fname)
+
+    if os.path.exists(out_path):
+        return f"/assets/remote/{fname}"
+
+    try:
+        r = requests.get(url, stream=True, timeout=12)
+        if r.status_code != 200:
+            return None
+        os.makedirs(REMOTE_DIR, exist_ok=True)
+        tmp_path = out_path + '.part'
+        with open(tmp_path, 'wb') as f:
+            for chunk in r.iter_content(1024):
+                if not chunk:
+                    break
+                f.write(chunk)
+        os.replace(tmp_path, out_path)
+        return f"/assets/remote/{fname}"
+    except Exception:
+        # Clean up partial
+        try:
+            if os.path.exists(out_path + '.part'):
+                os.remove(out_path + '.part')
+        except Exception:
+            pass
+        return None
+
+
+def _is_negatively_cached(character_name, now):
+    failed_at = _negative_cache.get(character_name)
+    return failed_at is not None and now - failed_at < NEGATIVE_TTL
+
+
+def _scrape_missing(manifest):
+    """Scrape fandom for characters that have no URLs yet, skipping recent failures."""
+    with _lock:
+        wanted = set(ALLOWED_CHARACTERS) | _pending
+        _pending.clear()
+
+    now = time.monotonic()
+    for character in sorted(wanted):
+        if _stop_event.is_set():
+            break
+        slug = slugify(character)
+        entry = manifest.get(slug)
+        if entry and entry["urls"]:
+            continue
+        with _lock:
+            if _is_negatively_cached(character, now):
+                continue
+
+        urls = fetch_character_images(character)
+        if not urls:
+            with _lock:
+                _negative_cache[character] = time.monotonic()
+            continue
+
+        entry = manifest.setdefault(slug, {"local": [], "remote": [], "svg": None, "urls": []})
+        entry["urls"] = urls
+        if not entry["local"] and not entry["remote"]:
+            local = download_and_cache_image(urls[0], character)
+            if local:
+                entry["remote"].append(local)
+
+
+def refresh_manifest(scrape=False):
+    """Rebuild the manifest from disk (and optionally fandom) and swap it in."""
+    global _manifest
+    manifest = scan_assets()
+    if scrape:
+        _scrape_missing(manifest)
+    _manifest = manifest
+    return manifest
+
+
+def _refresh_loop(interval):
+    while not _stop_event.is_set():
+        try:
+            refresh_manifest(scrape=SCRAPE_ENABLED)
+        except Exception as e:
+            print(f"Image manifest refresh failed: {e}")
+        _stop_event.wait(interval)
+
+
+def start_background_refresh(interval=REFRESH_INTERVAL):
+    """Build the manifest from disk now and keep refreshing it in a daemon thread."""
+    global _refresh_thread
+    refresh_manifest(scrape=False)
+    if _refresh_thread is not None and _refresh_thread.is_alive():
+        return
+    _stop_event.clear()
+    _refresh_thread = threading.Thread(
+        target=_refresh_loop, args=(interval,), name='image-manifest-refresh', daemon=True
+    )
+    _refresh_thread.start()
+
+
+def stop_background_refresh():
+    _stop_event.set()
+
+
+def manifest_stats():
+    manifest = _manifest
+    with _lock:
+        negative = len(_negative_cache)
+        pending = len(_pending)
+    return {
+        "characters": len(manifest),
+        "with_local": sum(1 for e in manifest.values() if e["local"] or e["remote"] or e["svg"]),
+        "with_urls": sum(1 for e in manifest.values() if e["urls"]),
+        "negative_cache": negative,
+        "pending": pending,
+    }
@@ -0,0 +1,203 @@
+"""FAISS index construction and query-time tuning shared by build and predict.
+
+`build_index.py` records how an index was built in `index_config.json` next
+to `index.faiss`; `predict_character.py` reads it back to apply the matching
+search-time parameters (`nprobe` for IVF, `efSearch` for HNSW).
+"""
+import json
+import math
+import os
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+CONFIG_FILE = "index_config.json"
+# Full-precision document vectors, row-aligned with the index and docstore
+VECTORS_FILE = "embeddings.npy"
+# Linear map from model space to the reduced space the index is built in
+PROJECTION_FILE = "projection.npz"
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+# How stored vectors are compressed: fp16/int8 scalar quantization or product quantization
+QUANTIZATIONS = ("none", "fp16", "int8", "pq")
+# Dimensionality reduction before indexing: PCA, or Matryoshka-style truncation
+REDUCTIONS = ("none", "pca", "truncate")
+SCALAR_QUANTIZERS = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+DEFAULT_PARAMS = {
+    "nlist": None,        # IVF cells; None -> about 4 * sqrt(n)
+    "nprobe": 16,         # IVF cells visited per query
+    "pq_m": 16,           # PQ sub-quantizers (must divide the dimension)
+    "pq_nbits": 8,        # bits per PQ code
+    "hnsw_m": 32,         # HNSW graph degree
+    "ef_construction": 200,
+    "ef_search": 64,
+    "rerank_factor": None,  # shortlist = k * factor, re-ranked in full precision; None -> 4 if lossy
+    "reduce_dim": 256,      # target dimension for pca / truncate
+}
+# Vectors are added in chunks and training uses a sample, so builds work
+# from a memory-mapped matrix without loading it whole
+ADD_CHUNK_ROWS = 65536
+MAX_TRAINING_ROWS = 100_000
+
+
+def default_nlist(n_vectors):
+    # FAISS wants ~39 training points per centroid; stay inside that
+    nlist = int(4 * math.sqrt(max(n_vectors, 1)))
+    return max(1, min(nlist, n_vectors // 39 or 1))
+
+
+def is_lossy(config):
+    """Whether index distances only approximate full-precision L2 distances."""
+    return (
+        config.get("index_type") == "ivf_pq"
+        or config.get("quantization") not in (None, "none")
+        or config.get("reduce") not in (None, "none")
+    )
+
+
+def training_sample(vectors, max_rows=MAX_TRAINING_ROWS, seed=0):
+    """Up to `max_rows` rows (in file order) as a contiguous float32 array."""
+    if len(vectors) > max_rows:
+        rows = np.sort(np.random.default_rng(seed).choice(len(vectors), max_rows, replace=False))
+        vectors = vectors[rows]
+    return np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+def fit_projection(vectors, method="pca", dim=256):
+    """Learn `(A, b)` so that `x @ A.T + b` maps vectors into `dim` dimensions."""
+    d = vectors.shape[1]
+    if not 0 < dim < d:
+        raise ValueError(f"Reduced dimension must be between 1 and {d - 1}, got {dim}")
+    if method == "pca":
+        pca = faiss.PCAMatrix(d, dim)
+        pca.train(training_sample(vectors))
+        A = faiss.vector_to_array(pca.A).reshape(dim, d)
+        b = faiss.vector_to_array(pca.b)
+        # PCA output is not unit-length; L2 on the projection is what we want
+        return {"A": A.astype(np.float32), "b": b.astype(np.float32), "normalize": False}
+    if method == "truncate":
+        # Keep the leading dimensions and renormalize, as for Matryoshka embeddings
+        A = np.eye(dim, d, dtype=np.float32)
+        return {"A": A, "b": np.zeros(dim, dtype=np.float32), "normalize": True}
+    raise ValueError(f"Unknown reduction: {method} (expected one of {REDUCTIONS})")
+
+
+def project(vectors, projection):
+    out = np.asarray(vectors, dtype=np.float32) @ projection["A"].T + projection["b"]
+    if projection["normalize"]:
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        out /= np.maximum(norms, 1e-12)
+    return np.ascontiguousarray(out, dtype=np.float32)
+
+
+def save_projection(index_dir, projection):
+    np.savez(Path(index_dir) / PROJECTION_FILE, **projection)
+
+
+def load_projection(index_dir):
+    path = Path(index_dir) / PROJECTION_FILE
+    if not path.exists():
+        return None
+    with np.load(path) as data:
+        return {"A": data["A"], "b": data["b"], "normalize": bool(data["normalize"])}
+
+
+def make_index(dim, index_type="flat", n_vectors=0, quantization="none", **params):
+    """Create an empty (untrained) index of the requested type and storage."""
+    p = {**DEFAULT_PARAMS, **{k: v for k, v in params.items() if v is not None}}
+    quantization = quantization or "none"
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization: {quantization} (expected one of {QUANTIZATIONS})")
+    sq = SCALAR_QUANTIZERS.get(quantization)
+
+    if index_type == "flat":
+        if sq is not None:
+            return faiss.IndexScalarQuantizer(dim, sq, faiss.METRIC_L2)
+        if quantization == "pq":
+            return faiss.IndexPQ(dim, p["pq_m"], p["pq_nbits"])
+        return faiss.IndexFlatL2(dim)
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = p["nlist"] or default_nlist(n_vectors)
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf_pq" or quantization == "pq":
+            if sq is not None:
+                raise ValueError("ivf_pq already stores PQ codes; use quantization 'none' or 'pq'")
+            return faiss.IndexIVFPQ(quantizer, dim, nlist, p["pq_m"], p["pq_nbits"])
+        if sq is not None:
+            return faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, sq, faiss.METRIC_L2)
+        return faiss.IndexIVFFlat(quantizer, dim, nlist)
+    if index_type == "hnsw":
+        if sq is not None:
+            index = faiss.IndexHNSWSQ(dim, sq, p["hnsw_m"])
+        elif quantization == "pq":
+            index = faiss.IndexHNSWPQ(dim, p["pq_m"], p["hnsw_m"])
+        else:
+            index = faiss.IndexHNSWFlat(dim, p["hnsw_m"])
+        index.hnsw.efConstruction = p["ef_construction"]
+        return index
+    raise ValueError(f"Unknown index type: {index_type} (expected one of {INDEX_TYPES})")
+
+
+def build_index(vectors, index_type="flat", quantization="none", projection=None, **params):
+    """Create, train (if needed) and fill an index from a (possibly memory-mapped) matrix.
+
+    With a `projection`, the index is built over the projected vectors.
+    """
+    def prepare(x):
+        if projection is not None:
+            return project(x, projection)
+        return np.ascontiguousarray(x, dtype=np.float32)
+
+    dim = projection["A"].shape[0] if projection is not None else vectors.shape[1]
+    index = make_index(dim, index_type, n_vectors=len(vectors), quantization=quantization, **params)
+    if not index.is_trained:
+        index.train(prepare(training_sample(vectors)))
+    for start in range(0, len(vectors), ADD_CHUNK_ROWS):
+        index.add(prepare(vectors[start:start + ADD_CHUNK_ROWS]))
+    return index
+
+
+def search_params(config):
+    """Query-time parameters for an index config, with env overrides."""
+    params = {}
+    index_type = config.get("index_type", "flat")
+    if index_type.startswith("ivf"):
+        params["nprobe"] = int(os.environ.get("FAISS_NPROBE", config.get("nprobe", DEFAULT_PARAMS["nprobe"])))
+    elif index_type == "hnsw":
+        params["efSearch"] = int(os.environ.get("FAISS_EF_SEARCH", config.get("ef_search", DEFAULT_PARAMS["ef_search"])))
+    return params
+
+
+def rerank_factor(config):
+    """Shortlist multiplier for full-precision re-ranking (0 disables it)."""
+    factor = os.environ.get("FAISS_RERANK_FACTOR", config.get("rerank_factor"))
+    if factor is None:
+        factor = 4 if is_lossy(config) else 0
+    return int(factor)
+
+
+def apply_search_params(index, params):
+    """Set `nprobe` / `efSearch` on an index (works through wrapper indexes)."""
+    space = faiss.ParameterSpace()
+    for name, value in params.items():
+        space.set_index_parameter(index, name, value)
+    return index
+
+
+def write_config(index_dir, config):
+    with open(Path(index_dir) / CONFIG_FILE, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+
+def load_config(index_dir):
+    path = Path(index_dir) / CONFIG_FILE
+    if not path.exists():
+        # Indexes built before index_config.json existed are exact flat indexes
+        return {"index_type": "flat"}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
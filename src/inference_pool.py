@@ -0,0 +1,142 @@
+"""Bounded executor that keeps model inference off the asyncio event loop.
+
+`InferenceExecutor.call` runs a blocking function (e.g. `predict_character`)
+on a thread or process pool. Admission is bounded by `workers + max_queue`
+outstanding jobs: anything beyond that is rejected immediately with
+`Overloaded` instead of piling up behind slow queries. Each call can carry a
+deadline and a Starlette request whose disconnect cancels the wait.
+"""
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+EXECUTOR_KIND = os.environ.get('INFERENCE_EXECUTOR', 'thread')
+WORKERS = int(os.environ.get('INFERENCE_WORKERS', 2))
+MAX_QUEUE = int(os.environ.get('INFERENCE_MAX_QUEUE', 32))
+DEADLINE_SECONDS = float(os.environ.get('PREDICT_DEADLINE_SECONDS', 10))
+DISCONNECT_POLL_SECONDS = 0.1
+
+
+class Overloaded(Exception):
+    """Raised when the inference queue is full."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a job does not finish before its deadline."""
+
+
+class ClientDisconnected(Exception):
+    """Raised when the client goes away while its job is pending."""
+
+
+class InferenceExecutor:
+    def __init__(self, workers=WORKERS, max_queue=MAX_QUEUE, kind=EXECUTOR_KIND, initializer=None,
+                 deadline=DEADLINE_SECONDS):
+        if kind == 'process':
+            self._pool = ProcessPoolExecutor(max_workers=workers, initializer=initializer)
+        elif kind == 'thread':
+            self._pool = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix='inference', initializer=initializer
+            )
+        else:
+            raise ValueError(f"Unknown executor kind: {kind}")
+
+        self.kind = kind
+        self.workers = workers
+        self.capacity = workers + max_queue
+        self.deadline = deadline
+        self.inflight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.disconnected = 0
+
+    def admit(self, slots=1):
+        """Reserve `slots` queue slots or raise `Overloaded`."""
+        # Only ever called from the event loop thread, so a plain counter is safe
+        if self.inflight + slots > self.capacity:
+            self.rejected += slots
+            raise Overloaded(f"Inference queue full ({self.inflight}/{self.capacity})")
+        self.inflight += slots
+
+    def release(self, slots=1):
+        self.inflight -= slots
+        self.completed += slots
+
+    def dispatch(self, fn, *args, slots=1):
+        """Schedule `fn(*args)` on already-admitted slots, returning an asyncio future.
+
+        The slots are held until the pool job itself finishes (or is cancelled
+        before starting), not merely until the caller stops waiting, so
+        abandoned jobs still count against capacity while they run.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            cf = self._pool.submit(fn, *args)
+        except Exception:
+            self.release(slots)
+            raise
+        cf.add_done_callback(lambda _: loop.call_soon_threadsafe(self.release, slots))
+        return asyncio.wrap_future(cf, loop=loop)
+
+    def submit(self, fn, *args):
+        """Admit and schedule `fn(*args)`, returning an asyncio future."""
+        self.admit()
+        return self.dispatch(fn, *args)
+
+    async def call(self, fn, *args, deadline=None, request=None):
+        """Run `fn(*args)` on the pool and wait for it with a deadline."""
+        return await self.wait(self.submit(fn, *args), deadline=deadline, request=request)
+
+    async def wait(self, fut, deadline=None, request=None):
+        """Wait for `fut`, cancelling it on deadline or client disconnect.
+
+        `deadline` defaults to the executor's per-request deadline.
+        """
+        if deadline is None:
+            deadline = self.deadline
+        watcher = None
+        waiters = {fut}
+        if request is not None:
+            watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+            waiters.add(watcher)
+
+        try:
+            done, _ = await asyncio.wait(waiters, timeout=deadline, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            # The caller itself was cancelled (e.g. a streaming response torn down)
+            fut.cancel()
+            raise
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+        if fut in done:
+            return fut.result()
+
+        fut.cancel()
+        if watcher is not None and watcher in done:
+            self.disconnected += 1
+            raise ClientDisconnected()
+        self.timed_out += 1
+        raise DeadlineExceeded(f"Inference did not finish within {deadline}s")
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "inflight": self.inflight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "disconnected": self.disconnected,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def _wait_for_disconnect(request):
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
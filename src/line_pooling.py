@@ -0,0 +1,89 @@
+"""Chunk and context-window vectors pooled from per-line embeddings.
+
+Every dialogue line is encoded exactly once, in `lines_by_character` order,
+into `data/index/lines/<model_key>.npy` (resumable and skipped when the
+lines are unchanged, see `corpus_encoder`). A document covering lines
+`[start, end)` of one character then gets the mean of those line vectors,
+renormalised to unit length; with a prefix-sum matrix over the lines that
+is two row lookups per document, so any window size or overlap can be tried
+without running the transformer again.
+
+Rows come out in the same order as `chunking.iter_chunked_documents` /
+`iter_contextual_documents`, so pooled vector `i` and document `i` agree.
+"""
+from pathlib import Path
+
+import numpy as np
+
+import corpus_encoder
+from chunking import chunk_ranges, context_ranges, lines_by_character
+
+LINES_DIR = Path("data/index/lines")
+STRATEGIES = ("chunked", "contextual")
+
+
+def character_lines(df):
+    """Every line in pooling order, plus the offset of each character's first line."""
+    texts, offsets = [], [0]
+    for _, lines in lines_by_character(df):
+        texts.extend(lines)
+        offsets.append(len(texts))
+    return texts, offsets
+
+
+def encode_lines(texts, model_name, model_key, store=None, workers=0, batch_size=256, lines_dir=LINES_DIR):
+    """Encode each line once into `<lines_dir>/<model_key>.npy` (memory-mapped)."""
+    lines_dir = Path(lines_dir)
+    lines_dir.mkdir(parents=True, exist_ok=True)
+    return corpus_encoder.encode_corpus(
+        texts, model_name, lines_dir / f"{model_key}.npy", store=store, workers=workers, batch_size=batch_size
+    )
+
+
+def prefix_sums(line_vectors):
+    """`[n + 1, d]` float64 running sums; rows `[a, b)` sum to `P[b] - P[a]`."""
+    sums = np.zeros((len(line_vectors) + 1, line_vectors.shape[1]), dtype=np.float64)
+    np.cumsum(line_vectors, axis=0, out=sums[1:])
+    return sums
+
+
+def pool_ranges(sums, starts, ends, extra=None):
+    """Unit-normalised sums of line ranges, optionally plus one extra line vector per row."""
+    pooled = sums[ends] - sums[starts]
+    if extra is not None:
+        pooled += extra
+    pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+    return pooled.astype(np.float32)
+
+
+def _absolute_ranges(offsets, ranges_for):
+    starts, ends = [], []
+    for first, last in zip(offsets, offsets[1:]):
+        for start, end in ranges_for(last - first):
+            starts.append(first + start)
+            ends.append(first + end)
+    return np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
+
+
+def chunk_vectors(line_vectors, offsets, chunk_size=10, overlap=3):
+    """One vector per `iter_chunked_documents` chunk: the mean of its lines."""
+    starts, ends = _absolute_ranges(offsets, lambda n: chunk_ranges(n, chunk_size, overlap))
+    return pool_ranges(prefix_sums(line_vectors), starts, ends)
+
+
+def context_vectors(line_vectors, offsets, window_size=5):
+    """One vector per line: its context window, with the line itself counted twice.
+
+    The doubled centre line mirrors `iter_contextual_documents`, whose text
+    is the main line followed by the whole window.
+    """
+    starts, ends = _absolute_ranges(offsets, lambda n: context_ranges(n, window_size))
+    return pool_ranges(prefix_sums(line_vectors), starts, ends, extra=np.asarray(line_vectors, dtype=np.float64))
+
+
+def pooled_vectors(line_vectors, offsets, strategy="chunked", chunk_size=15, overlap=5, window_size=5):
+    if strategy == "chunked":
+        return chunk_vectors(line_vectors, offsets, chunk_size, overlap)
+    if strategy == "contextual":
+        return context_vectors(line_vectors, offsets, window_size)
+    raise ValueError(f"Unknown pooling strategy {strategy!r}; expected one of {STRATEGIES}")
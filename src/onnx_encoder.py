@@ -0,0 +1,204 @@
+"""
+ONNX Runtime query encoder, a drop-in for `HuggingFaceEmbeddings`.
+
+The sentence-transformers model is exported once to ONNX (optionally with
+dynamic int8 weight quantization) under `data/models/onnx/`, then queries are
+encoded with ONNX Runtime: tokenize, run the transformer, mean-pool over the
+attention mask and L2-normalise, the same pipeline the PyTorch model uses.
+
+Select it in the API with ENCODER_BACKEND=onnx or ENCODER_BACKEND=onnx-int8.
+
+Check parity against the PyTorch encoder (exits non-zero if out of tolerance):
+    python src/onnx_encoder.py --check
+    python src/onnx_encoder.py --check --quantize
+"""
+from contextlib import contextmanager
+from pathlib import Path
+import argparse
+import fcntl
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+ONNX_DIR = Path("data/models/onnx")
+ENCODER_CONFIG = "encoder_config.json"
+
+# Parity thresholds against the PyTorch embeddings (unit vectors)
+FP32_MAX_ABS_DIFF = 1e-4
+INT8_MIN_COSINE = 0.98
+
+
+def model_dir(model_name, root=ONNX_DIR):
+    return Path(root) / re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name)
+
+
+@contextmanager
+def _export_lock(out_dir):
+    """Hold an exclusive lock on `out_dir` so concurrent workers export only once."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(out_dir / ".export.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _temp_path(path):
+    # Keep the .onnx suffix; the file is renamed into place once fully written
+    return path.with_name(f"{path.stem}.tmp{path.suffix}")
+
+
+def export_model(model_name, out_dir, quantize=False):
+    """Export a sentence-transformers model to ONNX and return the model path.
+
+    Files are written under a lock to a temporary name and renamed into place,
+    so other workers never load a half-written model, and an interrupted
+    export is redone on the next start.
+    """
+    out_dir = Path(out_dir)
+    fp32_path = out_dir / "model.onnx"
+    int8_path = out_dir / "model-int8.onnx"
+    target = int8_path if quantize else fp32_path
+    if target.exists():
+        return target
+
+    with _export_lock(out_dir):
+        _export(model_name, out_dir, fp32_path, int8_path, quantize)
+    return target
+
+
+def _export(model_name, out_dir, fp32_path, int8_path, quantize):
+    # Another worker may have finished the export while we waited for the lock
+    if not fp32_path.exists():
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        print(f"📦 Exporting {model_name} to ONNX...")
+        st_model = SentenceTransformer(model_name, device="cpu")
+        transformer = st_model[0].auto_model.eval()
+        tokenizer = st_model.tokenizer
+
+        tokenizer.save_pretrained(out_dir)
+        with open(out_dir / ENCODER_CONFIG, "w", encoding="utf-8") as f:
+            json.dump({"model_name": model_name, "max_seq_length": st_model.max_seq_length}, f, indent=2)
+
+        dummy = tokenizer(["Bazinga!"], return_tensors="pt")
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+        dynamic = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic["last_hidden_state"] = {0: "batch", 1: "sequence"}
+        tmp_path = _temp_path(fp32_path)
+        with torch.no_grad():
+            torch.onnx.export(
+                transformer,
+                tuple(dummy[name] for name in input_names),
+                str(tmp_path),
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic,
+                opset_version=14,
+            )
+        os.replace(tmp_path, fp32_path)
+
+    if quantize and not int8_path.exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        print("🗜️  Quantizing ONNX weights to int8...")
+        tmp_path = _temp_path(int8_path)
+        quantize_dynamic(str(fp32_path), str(tmp_path), weight_type=QuantType.QInt8)
+        os.replace(tmp_path, int8_path)
+
+
+class OnnxEmbeddings:
+    """Sentence embeddings computed with ONNX Runtime.
+
+    Implements `embed_documents` / `embed_query` like the LangChain
+    `HuggingFaceEmbeddings` it replaces, always returning normalised vectors.
+    """
+
+    def __init__(self, model_name, quantize=False, root=ONNX_DIR, batch_size=32, intra_op_threads=0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        directory = model_dir(model_name, root)
+        model_path = export_model(model_name, directory, quantize=quantize)
+
+        with open(directory / ENCODER_CONFIG, encoding="utf-8") as f:
+            self.max_seq_length = json.load(f)["max_seq_length"]
+        self.tokenizer = AutoTokenizer.from_pretrained(directory)
+        self.batch_size = batch_size
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _encode(self, texts):
+        batch = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np"
+        )
+        feeds = {name: batch[name].astype(np.int64) for name in self.input_names if name in batch}
+        hidden = self.session.run(["last_hidden_state"], feeds)[0]
+
+        # Mean pooling over real tokens, then L2 normalisation
+        mask = batch["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        out = [self._encode(texts[i:i + self.batch_size]) for i in range(0, len(texts), self.batch_size)]
+        return np.vstack(out).astype(np.float32).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def check_parity(model_name, quantize=False, n_texts=64):
+    """Compare ONNX and PyTorch embeddings on sample dialogue; return True if within tolerance."""
+    import columnar
+    from encoders import make_embeddings
+
+    texts = columnar.read_dialogues("data/processed/dialogues.arrow", columns=["text"])["text"].head(n_texts).tolist()
+    torch_encoder = make_embeddings(model_name, "torch")
+    onnx_encoder = make_embeddings(model_name, "onnx-int8" if quantize else "onnx")
+
+    timings = {}
+    vectors = {}
+    for name, encoder in (("torch", torch_encoder), ("onnx", onnx_encoder)):
+        encoder.embed_documents(texts[:4])  # warm-up
+        t0 = time.perf_counter()
+        vectors[name] = np.asarray(encoder.embed_documents(texts), dtype=np.float32)
+        timings[name] = (time.perf_counter() - t0) * 1000 / len(texts)
+
+    max_abs = float(np.abs(vectors["torch"] - vectors["onnx"]).max())
+    min_cos = float((vectors["torch"] * vectors["onnx"]).sum(axis=1).min())
+    print(f"🔬 {model_name} ({'int8' if quantize else 'fp32'} ONNX) on {len(texts)} lines")
+    print(f"   max |Δ| = {max_abs:.2e}, min cosine = {min_cos:.5f}")
+    print(f"   torch {timings['torch']:.2f} ms/line, onnx {timings['onnx']:.2f} ms/line "
+          f"({timings['torch'] / timings['onnx']:.2f}x)")
+
+    ok = min_cos >= INT8_MIN_COSINE if quantize else max_abs <= FP32_MAX_ABS_DIFF
+    print("✅ Parity OK" if ok else "❌ Parity check failed")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the query encoder to ONNX and check parity.")
+    parser.add_argument("--model", default="sentence-transformers/all-mpnet-base-v2")
+    parser.add_argument("--quantize", action="store_true", help="Use dynamic int8 weight quantization")
+    parser.add_argument("--check", action="store_true", help="Compare against the PyTorch encoder")
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(0 if check_parity(args.model, quantize=args.quantize) else 1)
+    print(f"✅ Exported to {export_model(args.model, model_dir(args.model), quantize=args.quantize)}")
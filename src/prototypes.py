@@ -0,0 +1,56 @@
+"""Per-character prototype vectors for nearest-centroid classification.
+
+Each character is summarised by its mean document vector or, with
+`per_character > 1`, by a few k-means centroids of its documents. All
+prototypes are unit-normalised, so scoring a query is one `[B, d] x [d, M]`
+product of cosine similarities. On disk (`prototypes.npz`):
+
+    vectors      float32 [M, d]  prototype vectors
+    characters   str     [M]     character of each prototype
+"""
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+PROTOTYPES_FILE = "prototypes.npz"
+
+# k-means needs a few points per centroid to be meaningful
+MIN_POINTS_PER_CENTROID = 39
+
+
+def _normalize(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def build_prototypes(vectors, characters, per_character=1, seed=0):
+    """Compute prototypes from row-aligned document vectors and character names."""
+    characters = np.asarray(characters, dtype=object)
+    out_vectors, out_characters = [], []
+    for name in sorted(set(characters.tolist()) - {None}):
+        members = np.ascontiguousarray(vectors[characters == name], dtype=np.float32)
+        n_centroids = min(per_character, len(members) // MIN_POINTS_PER_CENTROID)
+        if n_centroids > 1:
+            kmeans = faiss.Kmeans(members.shape[1], n_centroids, niter=20, seed=seed, spherical=True)
+            kmeans.train(members)
+            centroids = kmeans.centroids
+        else:
+            centroids = members.mean(axis=0, keepdims=True)
+        out_vectors.append(_normalize(centroids))
+        out_characters.extend([name] * len(centroids))
+    return {
+        "vectors": np.vstack(out_vectors).astype(np.float32),
+        "characters": np.asarray(out_characters, dtype=str),
+    }
+
+
+def save_prototypes(index_dir, prototypes):
+    np.savez(Path(index_dir) / PROTOTYPES_FILE, **prototypes)
+
+
+def load_prototypes(index_dir):
+    path = Path(index_dir) / PROTOTYPES_FILE
+    if not path.exists():
+        return None
+    with np.load(path) as data:
+        return {"vectors": data["vectors"], "characters": data["characters"]}
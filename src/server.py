@@ -1,13 +1,14 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
+import asyncio
+import json
 import os
-import re
-import requests
-from bs4 import BeautifulSoup
 import random
+import time
+from contextlib import asynccontextmanager
 from typing import Optional
 
 # Import predict_character from the same package in a way that works
@@ -15,16 +16,75 @@ from typing import Optional
 # executed directly (e.g. `python src/server.py`).
 try:
     # When run as a package module (recommended)
-    from .predict_character import predict_character
+    from .predict_character import predict_character_batch, catchphrase_prediction, cache_stats, warm_up
+    from . import image_manifest, inference_pool
+    from .inference_pool import InferenceExecutor, Overloaded, DeadlineExceeded, ClientDisconnected
+    from .batching import PredictionCoalescer
 except Exception:
     # Fallback: add the src dir to sys.path and import as top-level module
     import sys
     src_dir = os.path.dirname(__file__)
     if src_dir not in sys.path:
         sys.path.insert(0, src_dir)
-    from predict_character import predict_character
+    from predict_character import predict_character_batch, catchphrase_prediction, cache_stats, warm_up
+    import image_manifest
+    import inference_pool
+    from inference_pool import InferenceExecutor, Overloaded, DeadlineExceeded, ClientDisconnected
+    from batching import PredictionCoalescer
 
-app = FastAPI(title="Who Said What - Y2K Frontend API")
+# Bulk endpoint limits: each sub-batch of up to BULK_BATCH_SIZE lines is one inference job
+BULK_BATCH_SIZE = int(os.environ.get('PREDICT_BULK_BATCH_SIZE', 64))
+BULK_MAX_BATCH_SIZE = 256
+BULK_MAX_QUERIES = int(os.environ.get('PREDICT_BULK_MAX_QUERIES', 50000))
+
+WARMUP_ON_STARTUP = os.environ.get('WARMUP_ON_STARTUP', '1') != '0'
+
+# Created in the lifespan hook so process pools are not forked at import time
+inference = None
+coalescer = None
+
+# Reported by /readyz; flipped once the model and index are loaded and warm
+readiness = {"ready": False, "error": None, "timings": {}}
+STARTED_AT = time.time()
+
+
+async def _warm_up():
+    t0 = time.perf_counter()
+    try:
+        # Runs on the inference pool so its own thread/process is the one warmed
+        timings = await inference.submit(warm_up)
+    except Exception as e:
+        readiness["error"] = str(e)
+        print(f"Warm-up failed: {e}")
+        return
+    timings["total_seconds"] = round(time.perf_counter() - t0, 3)
+    readiness["timings"] = timings
+    readiness["ready"] = True
+    print(f"✓ Warm-up complete: {timings}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global inference, coalescer
+    # Build the image manifest from disk before serving; fandom scraping
+    # and image downloads run in the background refresher only.
+    image_manifest.start_background_refresh()
+    # Process workers each load and warm their own copy of the model
+    inference = InferenceExecutor(initializer=warm_up if inference_pool.EXECUTOR_KIND == 'process' else None)
+    coalescer = PredictionCoalescer(inference, predict_character_batch)
+    # Warm up in the background: the server answers /healthz at once and
+    # /readyz turns 200 only when the model and index are hot.
+    warm_task = asyncio.create_task(_warm_up()) if WARMUP_ON_STARTUP else None
+    if warm_task is None:
+        readiness["ready"] = True
+    yield
+    if warm_task is not None:
+        warm_task.cancel()
+    inference.shutdown()
+    image_manifest.stop_background_refresh()
+
+
+app = FastAPI(title="Who Said What - Y2K Frontend API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -42,199 +102,148 @@ app.add_middleware(
 async def api_predict(payload: Request):
     data = await payload.json()
     query = data.get('query', '').strip()
-    min_confidence = data.get('min_confidence', 0.25)
 
     if not query:
         return JSONResponse({"error": "Empty query"}, status_code=400)
+    try:
+        min_confidence = float(data.get('min_confidence', 0.25))
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "'min_confidence' must be a number"}, status_code=400)
 
     try:
-        result = predict_character(query, k=20, score_method="reciprocal_rank_fusion", min_confidence=min_confidence)
+        # Signature lines are answered on the event loop, skipping the queue entirely
+        result = catchphrase_prediction(query, min_confidence)
+        if result is None:
+            result = await coalescer.predict(
+                query, k=20, score_method="reciprocal_rank_fusion", min_confidence=min_confidence,
+                request=payload,
+            )
+    except Overloaded as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "1"})
+    except DeadlineExceeded as e:
+        return JSONResponse({"error": str(e)}, status_code=504)
+    except ClientDisconnected:
+        # Nobody is listening; 499 mirrors nginx's "client closed request"
+        return JSONResponse({"error": "Client disconnected"}, status_code=499)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
-    # Try to fetch representative images from fandom for the predicted character.
-    def fetch_character_images(character_name, max_images=6):
-        if not character_name:
-            return []
+    # Image fields come from the in-memory manifest; no network I/O per request
+    result.update(image_manifest.lookup_images(result.get('prediction')))
+
+    # Return prediction and character name
+    return JSONResponse(result)
 
-        # Build wiki URL (common fandom layout)
-        page_name = character_name.replace(' ', '_')
-        url = f'https://bigbangtheory.fandom.com/wiki/{page_name}'
 
+async def _admit_with_backoff(timeout):
+    """Wait up to `timeout` seconds for an inference slot."""
+    give_up = time.monotonic() + timeout
+    while True:
         try:
-            resp = requests.get(url, timeout=8)
-            if resp.status_code != 200:
-                return []
+            inference.admit()
+            return True
+        except Overloaded:
+            if time.monotonic() >= give_up:
+                return False
+            await asyncio.sleep(0.05)
+
+
+@app.post('/api/predict_batch')
+async def api_predict_batch(payload: Request):
+    """Classify many lines in one call, streaming NDJSON results in input order.
+
+    Body: {"queries": [...], "min_confidence": 0.25, "batch_size": 64}. Every
+    output line carries the input `index`; lines are flushed as each sub-batch
+    (one batched encode + search) completes, so only one sub-batch of results
+    is held in memory at a time.
+    """
+    data = await payload.json()
+    queries = data.get('queries')
 
-            soup = BeautifulSoup(resp.text, 'html.parser')
+    if not isinstance(queries, list) or not queries:
+        return JSONResponse({"error": "'queries' must be a non-empty list"}, status_code=400)
+    if len(queries) > BULK_MAX_QUERIES:
+        return JSONResponse({"error": f"At most {BULK_MAX_QUERIES} queries per request"}, status_code=413)
 
-            imgs = []
-            # Prefer JSON-LD and OpenGraph images when available
-            try:
-                # JSON-LD
-                for s in soup.find_all('script', type='application/ld+json'):
-                    try:
-                        import json
-                        jd = json.loads(s.string or '{}')
-                        for key in ('image', 'thumbnailUrl'):
-                            val = jd.get(key)
-                            if isinstance(val, str) and val:
-                                imgs.append(val)
-                        # nested mainEntity
-                        me = jd.get('mainEntity') or jd.get('about')
-                        if isinstance(me, dict):
-                            iv = me.get('image')
-                            if isinstance(iv, str) and iv:
-                                imgs.append(iv)
-                    except Exception:
-                        continue
-
-                # OpenGraph
-                og = soup.find('meta', property='og:image')
-                if og and og.get('content'):
-                    imgs.append(og.get('content'))
-            except Exception:
-                pass
-            # Look for images in the main content area and collect src/srcset
-            for img in soup.select('.mw-parser-output img, .article-table img, figure img'):
-                # prefer data-src (lazy-loaded images), then src
-                src = img.get('data-src') or img.get('src') or ''
-                if not src:
-                    # check srcset for candidates
-                    srcset = img.get('srcset') or ''
-                    if srcset:
-                        for part in srcset.split(','):
-                            url = part.strip().split(' ')[0]
-                            if url:
-                                src = url
-                                break
-                if not src:
-                    continue
-
-                # Make absolute URLs
-                if src.startswith('//'):
-                    src = 'https:' + src
-                if src.startswith('/'):
-                    src = 'https://bigbangtheory.fandom.com' + src
-
-                # If this is a Fandom thumbnail URL, try to reconstruct original image URL
-                if '/thumb/' in src:
-                    try:
-                        prefix, tail = src.split('/thumb/', 1)
-                        filename = tail.split('/')[-1].split('?')[0]
-                        candidate = prefix + '/' + filename
-                        if candidate.startswith('//'):
-                            candidate = 'https:' + candidate
-                        imgs.append(candidate)
-                    except Exception:
-                        pass
-
-                # Always include the src itself if it looks like an image (include webp)
-                if re.search(r'\.(jpg|jpeg|png|gif|webp)(?:\?|$)', src, re.I):
-                    imgs.append(src)
-
-                # Also consider srcset entries
-                srcset = img.get('srcset') or ''
-                if srcset:
-                    for part in srcset.split(','):
-                        url = part.strip().split(' ')[0]
-                        if url.startswith('//'):
-                            url = 'https:' + url
-                        if url.startswith('/'):
-                            url = 'https://bigbangtheory.fandom.com' + url
-                        if re.search(r'\.(jpg|jpeg|png|gif|webp)(?:\?|$)', url, re.I):
-                            imgs.append(url)
-
-            # Deduplicate while preserving order
-            seen = set(); out = []
-            for u in imgs:
-                if u in seen: continue
-                seen.add(u); out.append(u)
-                if len(out) >= max_images: break
-
-            return out
-        except Exception:
-            return []
-
-    images = []
     try:
-        images = fetch_character_images(result.get('prediction'))
-    except Exception:
-        images = []
-
-    # First, prefer curated local gallery images for the predicted character
-    pred = result.get('prediction')
+        batch_size = max(1, min(int(data.get('batch_size', BULK_BATCH_SIZE)), BULK_MAX_BATCH_SIZE))
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "'batch_size' must be an integer"}, status_code=400)
     try:
-        if pred:
-            slug = re.sub(r'[^a-z0-9]+', '_', pred.lower())[:60]
-            chars_dir = os.path.join(os.path.dirname(__file__), '..', 'frontend', 'assets', 'characters', slug)
-            if os.path.isdir(chars_dir):
-                files = [f for f in os.listdir(chars_dir) if os.path.isfile(os.path.join(chars_dir, f))]
-                if files:
-                    pick = random.choice(files)
-                    result['local_image'] = f"/assets/characters/{slug}/{pick}"
-    except Exception:
-        pass
+        min_confidence = float(data.get('min_confidence', 0.25))
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "'min_confidence' must be a number"}, status_code=400)
 
-    # Add image results to response if available (from scraping)
-    if images:
-        result['image_urls'] = images
-        result['image'] = images[0]
+    # Reject up front if the server is saturated, before committing to a 200
+    try:
+        inference.admit()
+    except Overloaded as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "1"})
 
-    # If still no local_image, attempt to download and cache the primary image locally for stability
-    if not result.get('local_image') and images:
+    async def stream():
+        # The first slot was taken above; later sub-batches wait for one
+        admitted = True
         try:
-            cache_dir = os.path.join(os.path.dirname(__file__), '..', 'frontend', 'assets', 'remote')
-            os.makedirs(cache_dir, exist_ok=True)
-
-            def download_and_cache_image(url, character_name):
-                try:
-                    r = requests.get(url, stream=True, timeout=12)
-                    if r.status_code != 200:
-                        return None
-                except Exception:
-                    return None
-
-                # File extension heuristic
-                raw = url.split('?')[0]
-                _, ext = os.path.splitext(raw)
-                if not re.search(r"\.(jpg|jpeg|png|gif|webp)$", ext, re.I):
-                    ext = '.jpg'
-
-                import hashlib
-                slug = re.sub(r'[^a-z0-9]+', '_', (character_name or 'char').lower())[:40]
-                h = hashlib.md5(url.encode('utf-8')).hexdigest()[:8]
-                fname = f"{slug}_{h}{ext}"
-                out_path = os.path.join(cache_dir, fname)
-
-                # If already cached, return relative path
-                if os.path.exists(out_path):
-                    return f"/assets/remote/{fname}"
-
-                try:
-                    with open(out_path, 'wb') as f:
-                        for chunk in r.iter_content(1024):
-                            if not chunk:
-                                break
-                            f.write(chunk)
-                    return f"/assets/remote/{fname}"
-                except Exception:
-                    # Clean up partial
+            for start in range(0, len(queries), batch_size):
+                chunk = [(q if isinstance(q, str) else '').strip() for q in queries[start:start + batch_size]]
+                rows = [i for i, q in enumerate(chunk) if q]
+
+                results = {}
+                if rows:
+                    if not admitted:
+                        admitted = await _admit_with_backoff(inference.deadline)
+                        if not admitted:
+                            yield json.dumps({"index": start, "error": "Inference queue full; stream aborted"}) + "\n"
+                            return
+                    fut = inference.dispatch(
+                        predict_character_batch, [chunk[i] for i in rows], 20, "reciprocal_rank_fusion", min_confidence
+                    )
+                    # The slot now belongs to the pool job and is released when it finishes
+                    admitted = False
                     try:
-                        if os.path.exists(out_path):
-                            os.remove(out_path)
-                    except Exception:
-                        pass
-                    return None
-
-            local = download_and_cache_image(images[0], result.get('prediction'))
-            if local:
-                result['local_image'] = local
-        except Exception:
-            pass
-
-    # Return prediction and character name
-    return JSONResponse(result)
+                        batch_results = await inference.wait(fut)
+                    except Exception as e:
+                        yield json.dumps({"index": start, "error": str(e)}) + "\n"
+                        return
+                    results = dict(zip(rows, batch_results))
+
+                lines = []
+                for i, q in enumerate(chunk):
+                    if i in results:
+                        result = results[i]
+                        result.update(image_manifest.lookup_images(result.get('prediction')))
+                        lines.append(json.dumps({"index": start + i, "query": q, **result}))
+                    else:
+                        lines.append(json.dumps({"index": start + i, "query": q, "error": "Empty query"}))
+                yield "\n".join(lines) + "\n"
+        finally:
+            if admitted:
+                inference.release()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.get('/healthz')
+async def healthz():
+    """Liveness: the process is up and the event loop is responsive."""
+    return JSONResponse({"status": "ok", "uptime_seconds": round(time.time() - STARTED_AT, 1)})
+
+
+@app.get('/readyz')
+async def readyz():
+    """Readiness: the model and index are loaded and warmed up."""
+    status_code = 200 if readiness["ready"] else 503
+    return JSONResponse(readiness, status_code=status_code)
+
+
+@app.get('/api/metrics')
+async def api_metrics():
+    return JSONResponse({
+        "executor": inference.stats(),
+        "batching": coalescer.stats(),
+        "caches": cache_stats(),
+        "images": image_manifest.manifest_stats(),
+    })
 
 
 @app.post('/api/predict_demo')
@@ -276,32 +285,7 @@ async def api_predict_demo(payload: Request):
         for o in others:
             scores[o] = round(per, 3)
 
-    # Attempt to locate a local image in assets (remote cache or curated characters)
-    local_image = None
-    try:
-        base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'frontend', 'assets'))
-        slug = re.sub(r'[^a-z0-9]+', '_', chosen.lower())[:60]
-
-        # Check curated character folder
-        char_dir = os.path.join(base_dir, 'characters', slug)
-        if os.path.isdir(char_dir):
-            files = [f for f in os.listdir(char_dir) if os.path.isfile(os.path.join(char_dir, f))]
-            if files:
-                local_image = f"/assets/characters/{slug}/{random.choice(files)}"
-
-        # Check remote cache
-        if not local_image:
-            remote_files = [f for f in os.listdir(os.path.join(base_dir, 'remote')) if f.lower().startswith(slug + '_')]
-            if remote_files:
-                local_image = f"/assets/remote/{random.choice(remote_files)}"
-
-        # Check single SVG fallback
-        if not local_image:
-            svg_path = os.path.join(base_dir, f"{slug}.svg")
-            if os.path.exists(svg_path):
-                local_image = f"/assets/{slug}.svg"
-    except Exception:
-        local_image = None
+    local_image = image_manifest.lookup_images(chosen).get('local_image')
 
     result = {
         'prediction': chosen,
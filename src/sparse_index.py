@@ -0,0 +1,97 @@
+"""BM25 inverted index over the same chunks as the FAISS index.
+
+Row `i` of the sparse index is row `i` of the docstore. The BM25 weight of
+every (term, document) pair is precomputed at build time, so a query is one
+sparse matrix product against its (binary) term vector. On disk:
+
+    sparse_vocab.json   term -> column of the query vectorizer
+    sparse_bm25.npz     float32 CSR [terms, docs] of BM25 weights
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+VOCAB_FILE = "sparse_vocab.json"
+MATRIX_FILE = "sparse_bm25.npz"
+
+# Keep one-letter words ("I", "a") and contractions ("you're") as tokens
+TOKEN_PATTERN = r"(?u)\b\w[\w']*\b"
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def _vectorizer(vocabulary=None, binary=False):
+    return CountVectorizer(lowercase=True, token_pattern=TOKEN_PATTERN, vocabulary=vocabulary,
+                           binary=binary, dtype=np.float32)
+
+
+class SparseIndex:
+    def __init__(self, vocabulary, term_docs):
+        self.vocabulary = vocabulary
+        # [terms, docs] so that queries @ term_docs gives [B, docs] scores
+        self.term_docs = term_docs.tocsr()
+        self._query_vectorizer = _vectorizer(vocabulary, binary=True)
+
+    @classmethod
+    def build(cls, texts, k1=BM25_K1, b=BM25_B):
+        vectorizer = _vectorizer()
+        tf = vectorizer.fit_transform(texts).tocsr()  # [docs, terms]
+        n_docs = tf.shape[0]
+
+        doc_len = np.asarray(tf.sum(axis=1)).ravel()
+        avg_len = max(float(doc_len.mean()), 1e-9) if n_docs else 1.0
+        df = np.bincount(tf.indices, minlength=tf.shape[1])
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        # BM25 term saturation and length normalisation, applied to the non-zeros only
+        row_len = np.repeat(doc_len, np.diff(tf.indptr))
+        norm = k1 * (1 - b + b * row_len / avg_len)
+        weights = tf.copy()
+        weights.data = (idf[tf.indices] * tf.data * (k1 + 1) / (tf.data + norm)).astype(np.float32)
+
+        vocabulary = {term: int(col) for term, col in vectorizer.vocabulary_.items()}
+        return cls(vocabulary, weights.T)
+
+    def save(self, directory):
+        directory = Path(directory)
+        with open(directory / VOCAB_FILE, "w", encoding="utf-8") as f:
+            json.dump(self.vocabulary, f)
+        sparse.save_npz(directory / MATRIX_FILE, self.term_docs)
+
+    @classmethod
+    def load(cls, directory):
+        directory = Path(directory)
+        with open(directory / VOCAB_FILE, encoding="utf-8") as f:
+            vocabulary = json.load(f)
+        return cls(vocabulary, sparse.load_npz(directory / MATRIX_FILE))
+
+    @staticmethod
+    def exists(directory):
+        return (Path(directory) / MATRIX_FILE).exists()
+
+    def __len__(self):
+        return self.term_docs.shape[1]
+
+    def search(self, texts, k):
+        """Top-k documents by BM25 for each text.
+
+        Returns `(scores, rows)`, both `[B, k]` and best first; documents that
+        share no term with the query are never returned, and the tail is
+        padded with row -1 and score 0.
+        """
+        scores = (self._query_vectorizer.transform(texts) @ self.term_docs).tocsr()
+        out_scores = np.zeros((len(texts), k), dtype=np.float32)
+        out_rows = np.full((len(texts), k), -1, dtype=np.int64)
+        for i in range(len(texts)):
+            start, end = scores.indptr[i], scores.indptr[i + 1]
+            rows, values = scores.indices[start:end], scores.data[start:end]
+            if len(rows) > k:
+                top = np.argpartition(-values, k - 1)[:k]
+                rows, values = rows[top], values[top]
+            order = np.lexsort((rows, -values))
+            out_rows[i, :len(order)] = rows[order]
+            out_scores[i, :len(order)] = values[order]
+        return out_scores, out_rows